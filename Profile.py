@@ -116,7 +116,6 @@ class ProfileHandler:
 
             # ➊ ثبت state در پشته
             push_state(context, "profile_menu")
-            context.user_data["state"] = "profile_menu"            
             
             chat_id   = update.effective_chat.id
 
@@ -155,7 +154,6 @@ class ProfileHandler:
         try:
             # ➊ ثبت state در پشته
             push_state(context, "profile_wallet_menu")
-            context.user_data["state"] = "profile_wallet_menu"
             
             chat_id   = update.effective_chat.id
 
@@ -195,6 +193,9 @@ class ProfileHandler:
     ) -> None:
         """Main handler for both */profile* command and pagination callbacks."""
 
+        after_id: str | None = None
+        before_id: str | None = None
+
         try:
             # 1) Detect origin (fresh /profile vs. pagination callback)
             if update.callback_query:
@@ -202,8 +203,17 @@ class ProfileHandler:
                 await query.answer()
                 chat_id = query.from_user.id
                 callback_parts = query.data.split("_")
-                if len(callback_parts) == 3 and callback_parts[1] == "page":
+                if len(callback_parts) in (3, 4) and callback_parts[1] == "page":
                     page = int(callback_parts[2])
+                    # کرسر keyset: a<id> = بعد از id ، b<id> = قبل از id
+                    if len(callback_parts) == 4 and page > 1:
+                        cursor_token = callback_parts[3]
+                        if cursor_token[:1] == "a":
+                            after_id = cursor_token[1:]
+                        elif cursor_token[:1] == "b":
+                            before_id = cursor_token[1:]
+                    if page > 1 and not (after_id or before_id):
+                        page = 1   # دکمهٔ قدیمی بدون کرسر → صفحهٔ اول
                 reply_func = query.edit_message_text
             else:
                 chat_id = update.effective_chat.id
@@ -216,7 +226,6 @@ class ProfileHandler:
 
             # 2) Persist FSM state (optional)
             push_state(context, "showing_profile")
-            context.user_data["state"] = "showing_profile"
             
             # 3) fetch profile – second fetch after ensure_user guarantees completeness
             profile: Dict[str, Any] | None = await self.db.get_profile(chat_id)
@@ -314,7 +323,10 @@ class ProfileHandler:
             #---------------------------------------------------------------------------------------------------------
             # 7) Down‑line list (only if joined & has referrals)
             if joined and downline_count:
-                downline: List[Dict[str, Any]] = await self.db.get_downline(chat_id, page)
+                downline: List[Dict[str, Any]]
+                downline, first_cursor, last_cursor = await self.db.get_downline(
+                    chat_id, after_id=after_id, before_id=before_id, page_size=PAGE_SIZE
+                )
                 start_idx: int = (page - 1) * PAGE_SIZE + 1
                 for idx, member in enumerate(downline, start=start_idx):
                     
@@ -328,13 +340,15 @@ class ProfileHandler:
                 # Pagination
                 total_pages = max(1, math.ceil(downline_count / PAGE_SIZE))
                 nav_row: List[InlineKeyboardButton] = []
-                if page > 1:
-                    nav_row.append(
-                        InlineKeyboardButton("⬅️ Prev", callback_data=f"profile_page_{page - 1}")
+                if page > 1 and first_cursor:
+                    prev_data = (
+                        "profile_page_1" if page == 2
+                        else f"profile_page_{page - 1}_b{first_cursor}"
                     )
-                if page < total_pages:
+                    nav_row.append(InlineKeyboardButton("⬅️ Prev", callback_data=prev_data))
+                if page < total_pages and last_cursor:
                     nav_row.append(
-                        InlineKeyboardButton("Next ➡️", callback_data=f"profile_page_{page + 1}")
+                        InlineKeyboardButton("Next ➡️", callback_data=f"profile_page_{page + 1}_a{last_cursor}")
                     )
                 if nav_row:
                     rows.append(nav_row)
@@ -556,7 +570,6 @@ class ProfileHandler:
         try:
                         # ذخیره state
             push_state(context, "awaiting_wallet")
-            context.user_data["state"] = "awaiting_wallet"
             
             chat_id = update.effective_chat.id
             old_address = await self.db.get_wallet_address(chat_id)
@@ -784,7 +797,6 @@ class ProfileHandler:
 
             # ۳) ذخیره state و موجودی
             push_state(context, "awaiting_transfer_amount")
-            context.user_data["state"] = "awaiting_transfer_amount"
             context.user_data["wallet_balance"] = balance
 
             # ۴) ارسال پیام درخواست مقدار انتقال
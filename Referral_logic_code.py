@@ -32,7 +32,7 @@ Key updates compared to v3 (hardening layer):
 This single file is self‑contained except for:
     • `config.py`      – runtime constants (wallet addresses, admin IDs, …)
     • `core.crypto_handler` – blockchain I/O (unchanged interface)
-    • `myproject_database.Database` – thin async wrapper around `motor` (Mongo)
+    • `myproject_database.Database` – thin async wrapper around PyMongo's async API (Mongo)
 """
 
 import asyncio
@@ -133,6 +133,13 @@ def _dec_to_micro(val: Decimal) -> int:
     """Convert a Decimal[USDT] → integer micro‑USDT (6 decimals)."""
     return int((val * MICRO).to_integral_value(rounding=ROUND_DOWN))
 
+
+# Fixed join-fee split – fee and rates are constants, so compute it once at import
+_REMAINING_USD     = JOIN_FEE_USD - INVITER_DIRECT_USD                                 # 45
+_COMPANY_MAIN_USD  = _round_down(COMPANY_MAIN_RATE * _REMAINING_USD)                  # 9
+_COMPANY_ALT_USD   = _round_down(COMPANY_ALT_RATE * _REMAINING_USD)                   # 4.5
+_UPSTREAM_POOL_USD = _round_down(_REMAINING_USD - _COMPANY_MAIN_USD - _COMPANY_ALT_USD)  # 31.5
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Referral Manager – async / database‑backed
 # ----------------------------------------------------------------------------
@@ -243,13 +250,21 @@ class ReferralManager:
             "direct_dates":   [],
             "eligible":       False,
             "joined":         False,             # ← اضافه شد
-            "tokens":         0,                 # ← اضافه شد
+            "tokens":         0.0,               # ← اضافه شد
             "balance_usd":    0.0,
             "commission_usd": 0.0,      # ← اضافه شد
+            "downline_count": 0,
             "created_at":     datetime.utcnow(),
         }
         await self.col_users.insert_one(new_doc)
 
+        # شمارندهٔ denormalized زیرمجموعه‌های inviter (get_profile دیگر count_documents نمی‌زند)
+        if inviter_id:
+            await self.col_users.update_one(
+                {"user_id": inviter_id},
+                {"$inc": {"downline_count": 1}}
+            )
+
         # … ادامه‌ی کدِ آپدیت inviter و پخش کمیسیون و توکن
         return new_doc
 
@@ -261,7 +276,7 @@ class ReferralManager:
 
         # Determine the search root (inviter’s slot or global ROOT)
         if inviter_id:
-            base_slot = (await self.col_users.find_one({"user_id": inviter_id}, {"slot_id": 1})) or {}
+            base_slot = (await self.col_users.find_one({"user_id": inviter_id}, {"_id": 0, "slot_id": 1})) or {}
             root_slot = base_slot.get("slot_id", "ROOT")
         else:
             root_slot = "ROOT"
@@ -287,7 +302,7 @@ class ReferralManager:
                     except mongo_errors.DuplicateKeyError:
                         continue  # extremely low‑probability clash – retry
             # Push children into BFS queue (rightmost preference ⇒ appendleft)
-            async for s in self.col_slots.find({"slot_id": {"$regex": f"^{parent}-c"}}, {"slot_id": 1}).sort("slot_id", -1):
+            async for s in self.col_slots.find({"slot_id": {"$regex": f"^{parent}-c"}}, {"_id": 0, "slot_id": 1}).sort("slot_id", -1):
                 queue.appendleft(s["slot_id"])
 
         # Should never reach here
@@ -297,46 +312,82 @@ class ReferralManager:
     # Eligibility calculation
     # -----------------------------------------------------------
     async def _refresh_eligibility(self, uid: int):
-        doc = await self.col_users.find_one({"user_id": uid}, {"direct_children": 1})
+        doc = await self.col_users.find_one({"user_id": uid}, {"_id": 0, "direct_children": 1})
         eligible_now = len(doc.get("direct_children", [])) >= 2 and uid not in MAIN_LEADER_IDS
         await self.col_users.update_one({"user_id": uid}, {"$set": {"eligible": eligible_now}})
 
     async def _is_eligible(self, uid: int) -> bool:
-        d = await self.col_users.find_one({"user_id": uid}, {"eligible": 1})
+        d = await self.col_users.find_one({"user_id": uid}, {"_id": 0, "eligible": 1})
         return bool(d and d.get("eligible"))
 
     # ────────────────────────────────────────────────────────────
     # Commission distribution (on each $50 join)
     # -----------------------------------------------------------
-    async def _distribute_commission(self, user_doc: Dict[str, Any]):
-        inviter_id = user_doc.get("inviter_id")
+    async def _distribute_commission(self, user_doc: Dict[str, Any], txid: str):
+        """
+        Split one confirmed $50 join fee (identified by its payment TxID).
+
+        Idempotent per TxID: the payments doc carries `split_done` plus a
+        `split_steps` list of finished steps, and the recipient plan is frozen in
+        `split_plan` on first run – so a retry after a partial failure finishes
+        only the remaining steps and never pays a step twice.
+        """
+        pay = await self.col_payments.find_one(
+            {"txid": txid, "split_done": {"$ne": True}},
+            {"_id": 0, "split_steps": 1, "split_plan": 1},
+        )
+        if pay is None:
+            self.logger.info(f"[commission] {txid} already split (or unknown) – skipped")
+            return
+        done = set(pay.get("split_steps", []))
+
+        # Freeze the plan once (eligibility may change between retries)
+        plan = pay.get("split_plan")
+        if plan is None:
+            ancestors = [a for a in user_doc.get("ancestors", []) if await self._is_eligible(a)]
+            share = _round_down(_UPSTREAM_POOL_USD / len(ancestors)) if ancestors else Decimal("0")
+            plan = {"ancestors": ancestors, "share": str(share)}
+            await self.col_payments.update_one(
+                {"txid": txid, "split_plan": {"$exists": False}},
+                {"$set": {"split_plan": plan}},
+            )
+            plan = (await self.col_payments.find_one(
+                {"txid": txid}, {"_id": 0, "split_plan": 1}
+            ))["split_plan"]
+
+        ancestors = plan["ancestors"]
+        share = Decimal(plan["share"])
+
+        # Remaining $45 dollars to split (precomputed at import)
+        remaining     = _REMAINING_USD
+        company_main  = _COMPANY_MAIN_USD   # 9 USDT
+        company_alt   = _COMPANY_ALT_USD    # 4.5 USDT
+        residue = remaining - company_main - company_alt - (share * len(ancestors))
 
+        inviter_id = user_doc.get("inviter_id")
+        steps = []
         # 1️⃣ Direct inviter bonus – paid immediately
         if inviter_id:
-            await self._credit_user(inviter_id, INVITER_DIRECT_USD, "direct‑5usd")
-
-        # Remaining $45 dollars to split
-        remaining = JOIN_FEE_USD - INVITER_DIRECT_USD
-        company_main = _round_down(COMPANY_MAIN_RATE * remaining)  # 9 USDT
-        company_alt  = _round_down(COMPANY_ALT_RATE * remaining)   # 4.5 USDT
-        upstream_pool = _round_down(remaining - company_main - company_alt)  # 31.5 USDT
-
-        await self._transfer_wallet(WALLET_SPLIT_20, company_main, "company‑20")
-        await self._transfer_wallet(WALLET_SPLIT_10, company_alt,  "company‑10")
-
-        # 2️⃣ 70 % upstream split among eligible ancestors (excluding ineligible)
-        ancestors = [a for a in user_doc["ancestors"] if await self._is_eligible(a)]
-        if ancestors:
-            share = _round_down(upstream_pool / len(ancestors))
-            for anc in ancestors:
-                await self._credit_user(anc, share, "upstream‑share")
-        else:
-            share = Decimal("0")
-
+            steps.append(("direct", lambda: self._credit_user(inviter_id, INVITER_DIRECT_USD, "direct‑5usd")))
+        steps.append(("company-20", lambda: self._transfer_wallet(WALLET_SPLIT_20, company_main, "company‑20")))
+        steps.append(("company-10", lambda: self._transfer_wallet(WALLET_SPLIT_10, company_alt, "company‑10")))
+        # 2️⃣ 70 % upstream split among eligible ancestors (excluding ineligible)
+        for anc in ancestors:
+            steps.append((f"upstream:{anc}", lambda anc=anc: self._credit_user(anc, share, "upstream‑share")))
         # Any rounding residue is kept in the join pool wallet
-        residue = remaining - company_main - company_alt - (share * len(ancestors))
         if residue > 0:
-            await self._transfer_wallet(WALLET_JOIN_POOL, residue, "round‑residue")
+            steps.append(("residue", lambda: self._transfer_wallet(WALLET_JOIN_POOL, residue, "round‑residue")))
+
+        for key, run in steps:
+            if key in done:
+                continue
+            await run()     # raises → split_done stays unset, finished steps are kept
+            await self.col_payments.update_one({"txid": txid}, {"$addToSet": {"split_steps": key}})
+
+        await self.col_payments.update_one(
+            {"txid": txid},
+            {"$set": {"split_done": True, "split_at": datetime.utcnow()}},
+        )
 
     # Credit helper – routes to the correct corporate/admin pool or user balance
     async def _credit_user(self, uid: int, amount: Decimal, note: str):
@@ -491,9 +542,20 @@ class ReferralManager:
         seventy = _round_down(bal * Decimal("0.70"))
         twenty  = _round_down(bal * Decimal("0.20"))
         ten     = bal - seventy - twenty
-        await self._transfer_wallet(WALLET_SPLIT_70, seventy, "join‑70")
-        await self._transfer_wallet(WALLET_SPLIT_20, twenty,  "join‑20")
-        await self._transfer_wallet(WALLET_SPLIT_10, ten,    "join‑10")
+        # سه انتقال مستقل‌اند → هم‌زمان (زمان کل ≈ یک تراکنش به‌جای سه)
+        splits = [
+            (WALLET_SPLIT_70, seventy, "join‑70"),
+            (WALLET_SPLIT_20, twenty,  "join‑20"),
+            (WALLET_SPLIT_10, ten,     "join‑10"),
+        ]
+        splits = [sp for sp in splits if sp[1] > 0]
+        results = await asyncio.gather(
+            *(self._transfer_wallet(w, amt, note) for w, amt, note in splits),
+            return_exceptions=True,
+        )
+        for (_, amt, note), res in zip(splits, results):
+            if isinstance(res, Exception) or res is None:
+                logger.error("Join-pool split %s (%s USDT) not sent: %s", note, amt, res)
         
     ###------------------------------------------------------------------------------------
     
@@ -631,7 +693,10 @@ class ReferralManager:
     ###---------------------------------------------------------------------------------
     async def _payout_every_30_days(self):
         now = datetime.utcnow()
-        async for user in self.col_users.find({"balance_usd": {"$gt": 0}}):
+        async for user in self.col_users.find(
+            {"balance_usd": {"$gt": 0}},
+            {"_id": 0, "user_id": 1, "balance_usd": 1, "tron_wallet": 1},
+        ):
             uid = user["user_id"]
             if uid in MAIN_LEADER_IDS + SECOND_LEADER_USER_IDS:
                 continue  # admins handled separately
@@ -666,7 +731,7 @@ class ReferralManager:
                         
     ###---------------------------------------------------------------------------------
     async def _second_child_date(self, uid: int) -> Optional[datetime]:
-        doc = await self.col_users.find_one({"user_id": uid}, {"direct_dates": 1})
+        doc = await self.col_users.find_one({"user_id": uid}, {"_id": 0, "direct_dates": 1})
         dates = doc.get("direct_dates", []) if doc else []
         return dates[1] if len(dates) >= 2 else None
 
@@ -690,6 +755,7 @@ class ReferralManager:
             tok = MAX_DISTRIBUTION_SUPPLY - dist
         await self.col_counters.update_one({"_id": "token"}, {"$inc": {"dist": float(tok)}})
         await self.col_users.update_one({"user_id": new_user["user_id"]}, {"$inc": {"tokens": float(tok)}})
+        self.db.invalidate_user_cache(new_user["user_id"])
 
     # ────────────────────────────────────────────────────────────
     # Misc helpers
@@ -711,7 +777,7 @@ class ReferralManager:
         current = inviter_id
         while current:
             chain.append(current)
-            row = await self.col_users.find_one({"user_id": current}, {"inviter_id": 1})
+            row = await self.col_users.find_one({"user_id": current}, {"_id": 0, "inviter_id": 1})
             current = row.get("inviter_id") if row else None
         return chain
 
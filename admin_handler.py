@@ -51,7 +51,6 @@ class AdminHandler:
         try:
             
             push_state(context, "admin_panel_menu")         # ← این خط اضافه شد
-            context.user_data["state"] = "admin_panel_menu" # ← برای سازگاری
             # توضیح منوی ادمین (می‌توانی با توجه به زبان کاربر ترجمه هم بکنی)
             panel_message = (
                 "🛠 <b>Admin Panel</b>\n"
@@ -87,7 +86,6 @@ class AdminHandler:
         try:
             
             push_state(context, "admin_price_snapshot")
-            context.user_data["state"] = "admin_price_snapshot"            
             
             if not self._is_admin(update):  # مجوز
                 return
@@ -120,7 +118,6 @@ class AdminHandler:
         try:
             # ثبت state اختصاصی
             push_state(context, "admin_set_total_supply")
-            context.user_data["state"] = "admin_set_total_supply"
 
             if not self._is_admin(update):
                 return
@@ -165,7 +162,6 @@ class AdminHandler:
         try:
             # ثبت state اختصاصی
             push_state(context, "admin_flush_price_cache")
-            context.user_data["state"] = "admin_flush_price_cache"
 
             if not self._is_admin(update):
                 return
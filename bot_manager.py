@@ -49,7 +49,7 @@ from core.blockchain_client import BlockchainClient
 
 from config import ADMIN_USER_IDS, SUPPORT_USER_USERNAME, WALLET_JOIN_POOL
 #, TRADE_WALLET_ADDRESS
-from state_manager import pop_state, push_state
+from state_manager import pop_state, push_state, PayState
 import inspect
 
 CHANNEL_USERNAME = "@DaobankChannel"   # فقط یک‌بار تعریف؛ اگر متعدد دارید محیطی کنید.
@@ -266,6 +266,9 @@ class BotManager:
                 error_handler=self.error_handler,
             )
             
+            await self.payment_handler.warmup()
+            await self.payment_handler.resume_pending(self.application.bot)
+            await self.payment_handler.resume_trades(self.application.bot)
             self.logger.info("PaymentHandler initialized (wallet=%s)", WALLET_JOIN_POOL)
 
             self.support_handler = SupportHandler(
@@ -695,9 +698,9 @@ class BotManager:
             self.application.add_handler(
                 CallbackQueryHandler( self.language_choice_callback, pattern=r"^(choose_language|skip_language)$" ), group=0)
 
-            # صفحه‌بندی (pattern = profile_page_⟨n⟩)
+            # صفحه‌بندی (pattern = profile_page_⟨n⟩[_a⟨id⟩|_b⟨id⟩])
             self.application.add_handler(
-                CallbackQueryHandler( self.profile_handler.show_profile, pattern=r'^profile_page_\\d+$'), group=0)
+                CallbackQueryHandler( self.profile_handler.show_profile, pattern=r'^profile_page_\d+(_[ab][0-9a-f]{24})?$'), group=0)
 
             self.application.add_handler(
                 CallbackQueryHandler(self.profile_handler.handle_view_all_payouts, pattern=r"^view_all_payouts_"), group=0)
@@ -902,7 +905,7 @@ class BotManager:
                    
             ########################################################################################################
 
-            elif current_state == 'awaiting_sub_txid':                             # Subscription
+            elif current_state == PayState.AWAITING_TXID:                          # Subscription
                 return await self.payment_handler.handle_txid(update, context)     # ← شاخهٔ جدید            
             
             # State-based handling for language detection
@@ -939,7 +942,6 @@ class BotManager:
             chat_id = update.effective_chat.id
             # تنظیم state برای منوی Help & Support
             push_state(context, "help_support_menu")
-            context.user_data['state'] = 'help_support_menu'
 
             # متن توضیحی درباره دکمه‌ها
             text = (
@@ -1069,10 +1071,10 @@ class BotManager:
             "showing_payment":             self.payment_handler.show_payment_instructions,
             
                     # ▼ اضافه کردن state گم‌شده
-            "prompt_txid":                 self.payment_handler.show_payment_instructions,
+            PayState.PROMPT_TXID:          self.payment_handler.show_payment_instructions,
         
-            "awaiting_sub_txid":           self.payment_handler.prompt_for_txid,
-            "sub_txid_received":           self.payment_handler.handle_txid,
+            PayState.AWAITING_TXID:        self.payment_handler.prompt_for_txid,
+            PayState.TXID_RECEIVED:        self.payment_handler.handle_txid,
             ###################-------------------------------------------------------------------------
             "withdraw_menu":               self.withdraw_handler.show_withdraw_menu,   # ← NEW
             ###################-------------------------------------------------------------------------
@@ -1148,17 +1150,15 @@ class BotManager:
             "🔄 convert token":             "convert_token",
             "💼 earn money":                "earn_money_menu",
             "💸 withdraw":                  "withdraw_menu",        
-            "#️⃣ txid (transaction hash)":   "awaiting_sub_txid",
+            "#️⃣ txid (transaction hash)":   PayState.AWAITING_TXID,
             
         }
         state = menu_map.get(text)
         if state:
             # ➊ push شدن state به پشته
             push_state(context, state)
-            # ➋ همزمان برای backward-compatibility
-            context.user_data['state'] = state
 
-            # ➌ روتِر را نگاه کنیم و تابع مرتبط را اجرا کنیم
+            # ➋ روتِر را نگاه کنیم و تابع مرتبط را اجرا کنیم
             handler = self._state_router[state]
             await handler(update, context) 
                                 
@@ -1218,6 +1218,14 @@ class BotManager:
                 await self.application.shutdown()
                 self.logger.info("Telegram application stopped successfully.")
 
+            # ─── بستن کلاینت HTTP مشترک پرداخت
+            if self.payment_handler:
+                await self.payment_handler.aclose()
+
+            # ─── بستن کلاینت‌های بلاک‌چین (HTTP + AsyncTron)
+            if self.blockchain:
+                await self.blockchain.close()
+
             # ─── بستن اتصال به دیتابیس
             if self.db:
                 self.logger.info("Closing database connection...")
@@ -1231,7 +1239,7 @@ class BotManager:
                         close_method()
                 # در غیر این صورت، مستقیم کانکشن MongoClient را ببند
                 elif hasattr(self.db, 'client') and hasattr(self.db.client, 'close'):
-                    self.db.client.close()
+                    await self.db.client.close()
                 self.logger.info("Database connection closed.")
 
             # ─── به‌روزرسانی وضعیت برنامه
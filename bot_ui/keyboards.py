@@ -2,7 +2,8 @@
 
 from __future__ import annotations
 import os
-from typing import List, TYPE_CHECKING
+from collections import OrderedDict
+from typing import List, Tuple, TYPE_CHECKING
 
 from telegram import KeyboardButton, ReplyKeyboardMarkup
 
@@ -17,6 +18,14 @@ if TYPE_CHECKING:
 
 
 class TranslatedKeyboards:
+    # KeyboardButton با متن ساده فقط به رشته وابسته است → یک نمونه برای هر متن کافی است
+    _BUTTON_POOL_MAX: int = 512
+    _button_pool: "OrderedDict[str, KeyboardButton]" = OrderedDict()
+
+    # کیبورد کامل فقط به (دکمه‌های خام، زبان، گزینه‌ها) وابسته است → یک بار برای هر زبان
+    _MARKUP_CACHE_MAX: int = 256
+    _markup_cache: "OrderedDict[Tuple, ReplyKeyboardMarkup]" = OrderedDict()
+
     def __init__(self, db: Database, translator: SimpleTranslator):
         """
         :param db: پایگاه داده برای دریافت زبان کاربر
@@ -35,18 +44,51 @@ class TranslatedKeyboards:
     ) -> ReplyKeyboardMarkup:
         """
         تمام دکمه‌ها را به زبان کاربر ترجمه می‌کند (هیچ استثنایی وجود ندارد).
+        نتیجه برای هر (دکمه‌ها، زبان، گزینه‌ها) کش می‌شود (ReplyKeyboardMarkup در PTB v20 immutable است).
         """
+        key = (tuple(map(tuple, raw_buttons)), user_lang, resize, one_time)
+        cache = self._markup_cache
+        markup = cache.get(key)
+        if markup is not None:
+            cache.move_to_end(key)
+            return markup
+
         translated_buttons = []
+        any_translated = False
         for row in raw_buttons:
             new_row = []
             for text_en in row:
                 text_translated = await self.translator.translate_text(text_en, user_lang)
-                new_row.append(KeyboardButton(text_translated))
+                any_translated = any_translated or text_translated != text_en
+                new_row.append(self._pooled_button(text_translated))
             translated_buttons.append(new_row)
 
-        return ReplyKeyboardMarkup(
+        markup = ReplyKeyboardMarkup(
             translated_buttons, resize_keyboard=resize, one_time_keyboard=one_time
         )
+        # اگر هیچ دکمه‌ای ترجمه نشد (احتمالاً خطای ترجمه) کش نکن تا دفعهٔ بعد دوباره تلاش شود
+        if any_translated or user_lang == "en":
+            cache[key] = markup
+            if len(cache) > self._MARKUP_CACHE_MAX:
+                cache.popitem(last=False)
+        return markup
+
+    @classmethod
+    def _pooled_button(cls, text: str) -> KeyboardButton:
+        """
+        KeyboardButton مشترک برای هر متن ترجمه‌شده (LRU محدود به _BUTTON_POOL_MAX).
+        """
+        pool = cls._button_pool
+        btn = pool.get(text)
+        if btn is not None:
+            pool.move_to_end(text)
+            return btn
+
+        btn = KeyboardButton(text)
+        pool[text] = btn
+        if len(pool) > cls._BUTTON_POOL_MAX:
+            pool.popitem(last=False)
+        return btn
 
 
     # ----------------- ترجمه و ساخت کیبورد -----------------
@@ -3,10 +3,21 @@
 
 # language_Manager.py
 
+import asyncio
+import logging
+from typing import Dict, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+PREWARM_CONCURRENCY = 4          # سقف ترجمهٔ هم‌زمان هنگام گرم کردن کش
+
+
 class TranslationManager:
     def __init__(self, db, translator):
         self.db = db
         self.translator = translator
+        # ترجمه‌های در جریان: درخواست‌های هم‌زمان برای یک (متن، زبان) یک فراخوانی LLM مشترک دارند
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
 
     async def get_translated_message(self, text: str, user_lang: str) -> str:
         if user_lang.lower() == "en":
@@ -16,8 +27,23 @@ class TranslationManager:
         if cached_translation is not None:
             return cached_translation
 
-        translated_text = await self.translator.translate_text(text, user_lang)
-        return translated_text
+        key = (text, user_lang)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            translated_text = await self.translator.translate_text(text, user_lang)
+            fut.set_result(translated_text)
+            return translated_text
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()          # جلوگیری از هشدار «exception never retrieved»
+            raise
+        finally:
+            del self._inflight[key]
 
     async def translate_for_user(self, text: str, chat_id: int) -> str:
         """
@@ -28,3 +54,30 @@ class TranslationManager:
         if not user_lang:
             user_lang = 'en'
         return await self.get_translated_message(text, user_lang)
+
+    async def prewarm(self, texts: Iterable[str]) -> None:
+        """
+        ترجمهٔ متن‌های ثابت برای همهٔ زبان‌های کاربران (در startup)،
+        تا اولین کاربر هر زبان منتظر LLM نماند.
+        """
+        texts = list(texts)
+        try:
+            languages = await self.db.get_known_languages()
+        except Exception as e:
+            logger.warning(f"Translation prewarm skipped: {e}")
+            return
+
+        sem = asyncio.Semaphore(PREWARM_CONCURRENCY)
+
+        async def _one(text: str, lang: str) -> None:
+            async with sem:
+                await self.get_translated_message(text, lang)
+
+        results = await asyncio.gather(
+            *(_one(t, lang) for lang in languages if lang.lower() != "en" for t in texts),
+            return_exceptions=True,
+        )
+        failed = sum(isinstance(r, Exception) for r in results)
+        logger.info(
+            f"Translation prewarm: {len(texts)} texts × {len(languages)} languages ({failed} failed)"
+        )
@@ -0,0 +1,41 @@
+# cache.py
+
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+# ─── کش درون‌حافظه‌ای TTL + LRU (کش‌های Database و هندلرها) ─────────────────
+MISS = object()
+
+
+class TTLCache:
+    """
+    کش سادهٔ LRU با انقضای زمانی؛ فقط از داخل event-loop صدا زده می‌شود
+    (بدون await بین خواندن و نوشتن) پس نیازی به Lock ندارد.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Any) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return MISS
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return MISS
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any) -> None:
+        self._data.pop(key, None)
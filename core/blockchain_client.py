@@ -19,12 +19,14 @@ from __future__ import annotations
 import os
 import asyncio
 import random
+import time
 from typing import Optional, Tuple
 
 import httpx
 from tronpy import AsyncTron
 from tronpy.providers import AsyncHTTPProvider   # ← NEW
 from tronpy.exceptions import TransactionError
+from tronpy.keys import PrivateKey
 
 import config
 
@@ -32,6 +34,7 @@ import config
 # Constants
 # ────────────────────────────────────────────────────────────
 TRONSCAN_BASE = "https://apilist.tronscan.org/api"
+TRONSCAN_TX_INFO_URL = f"{TRONSCAN_BASE}/transaction-info"
 
 DEFAULT_USDT_CONTRACT = config.USDT_CONTRACT  # USDT-TRC20 (mainnet)
 
@@ -40,6 +43,10 @@ TRON_PROVIDER_URL = config.TRON_PROVIDER_URL
 
 DECIMALS = 6  # USDT has 6 decimals
 
+# Circuit breaker: after N consecutive failed requests, short-circuit for COOLDOWN seconds
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
 
 # ────────────────────────────────────────────────────────────
 # Helper – simple exponential backoff with jitter
@@ -60,21 +67,44 @@ class BlockchainClient:
 
         # AsyncTron اتصال را فقط در صورت نیاز می‌سازیم
         self._tron: AsyncTron | None = None
+        # کلید خصوصی hex → (PrivateKey, آدرس base58)؛ مشتق‌گیری ECDSA فقط یک بار
+        self._keys: dict[str, Tuple[PrivateKey, str]] = {}
+
+        # یک کلاینت HTTP مشترک (keep-alive) برای همهٔ lookupها؛ در اولین استفاده ساخته می‌شود
+        self._http: httpx.AsyncClient | None = None
+
+        # وضعیت circuit breaker (مشترک بین همهٔ فراخوانی‌های _http_get)
+        self._cb_failures = 0
+        self._cb_open_until = 0.0
 
     # ────────────────────────────────────────────────
     # Internal helpers
     # ────────────────────────────────────────────────
-    async def _http_get(self, url: str, max_retries: int = 3) -> Optional[dict]:
+    async def _http_get(
+        self, url: str, params: Optional[dict] = None, max_retries: int = 3
+    ) -> Optional[dict]:
         """
         GET with simple retry / back-off.
+
+        While the circuit breaker is open (API down / rate-limited) returns None
+        immediately instead of hitting the API again.
         """
-        headers = {"TRON-PRO-API-KEY": self.api_key} if self.api_key else {}
+        if time.monotonic() < self._cb_open_until:
+            return None
+
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=10,
+                headers={"TRON-PRO-API-KEY": self.api_key} if self.api_key else None,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+            )
+
         attempt = 0
         while attempt < max_retries:
             try:
-                async with httpx.AsyncClient(timeout=10) as client:
-                    r = await client.get(url, headers=headers)
+                r = await self._http.get(url, params=params)
                 if r.status_code == 200:
+                    self._cb_failures = 0
                     return r.json()
 
                 # 429 یا 5xx  → دوباره تلاش
@@ -82,12 +112,35 @@ class BlockchainClient:
                     attempt += 1
                     await _sleep_backoff(attempt)
                     continue
+                # پاسخ منطقی (مثلاً 404) یعنی API سالم است
+                self._cb_failures = 0
                 return None
             except httpx.RequestError:
                 attempt += 1
                 await _sleep_backoff(attempt)
+
+        # همهٔ تلاش‌ها ناموفق → شمارش برای breaker
+        self._cb_failures += 1
+        if self._cb_failures >= BREAKER_THRESHOLD:
+            self._cb_open_until = time.monotonic() + BREAKER_COOLDOWN
+            self._cb_failures = 0
         return None
 
+    #───────────────────────────────────────────────────────────
+    async def _load_key(self, private_key_hex: str) -> Tuple[PrivateKey, str]:
+        """
+        PrivateKey و آدرس owner را یک بار (در thread) می‌سازد و کش می‌کند؛
+        ضرب نقطه‌ای secp256k1 در tronpy پایتونی است و نباید event-loop را بگیرد.
+        """
+        cached = self._keys.get(private_key_hex)
+        if cached is None:
+            def _derive() -> Tuple[PrivateKey, str]:
+                key = PrivateKey(bytes.fromhex(private_key_hex))
+                return key, key.public_key.to_base58check_address()
+
+            cached = self._keys[private_key_hex] = await asyncio.to_thread(_derive)
+        return cached
+
     #───────────────────────────────────────────────────────────
     async def _get_tron(self) -> AsyncTron:
         """
@@ -131,7 +184,7 @@ class BlockchainClient:
         """
         token_contract = token_contract or DEFAULT_USDT_CONTRACT
 
-        data = await self._http_get(f"{TRONSCAN_BASE}/transaction-info?hash={txid}")
+        data = await self._http_get(TRONSCAN_TX_INFO_URL, params={"hash": txid})
         if not data or data.get("contractType") != 31:
             return False
 
@@ -176,20 +229,18 @@ class BlockchainClient:
         token_contract = token_contract or DEFAULT_USDT_CONTRACT
         tron = await self._get_tron()
 
-        # owner address derived from the private key
-        wallet = tron.generate_wallet(private_key=from_private_key)
+        # owner address derived from the private key (cached)
+        key, owner = await self._load_key(from_private_key)
         contract = await tron.get_contract(token_contract)
 
-        txn = (
-            contract.functions.transfer(
-                to_address,
-                int(round(amount * (10**decimals))),
-            )
-            .with_owner(wallet.default_address)
-            .memo(memo or "")
-            .build()
-            .sign(from_private_key)
+        txb = await contract.functions.transfer(
+            to_address,
+            int(round(amount * (10**decimals))),
         )
+        txn = await txb.with_owner(owner).memo(memo or "").build()
+
+        # امضای ECDSA روی thread تا انتقال‌های هم‌زمان (gather) event-loop را سریالی نکنند
+        txn = await asyncio.to_thread(txn.sign, key)
 
         result = await txn.broadcast()
         if result.get("result"):
@@ -200,6 +251,9 @@ class BlockchainClient:
     # Clean-up
     # ────────────────────────────────────────────────
     async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
         if self._tron is not None:
             await self._tron.close()
             self._tron = None
@@ -95,7 +95,8 @@ class DynamicPriceProvider:
             collection = getattr(self.db, "collection_users", None)
             if collection is None:
                 collection = self.db.db["users"]
-            agg = await collection.aggregate(pipeline).to_list(1)
+            cursor = await collection.aggregate(pipeline)
+            agg = await cursor.to_list(1)
         except Exception as e:
             logger.error("Failed to aggregate circulating supply: %s", e)
             return Decimal("0")
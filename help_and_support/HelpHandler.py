@@ -40,8 +40,6 @@ class HelpHandler:
             
             # ───➤ ست‌کردن state برای این مرحله
             push_state(context, "showing_guide")
-            # (اختیاری برای backward-compatibility)
-            context.user_data['state'] = "showing_guide"                  
             
             chat_id = update.effective_chat.id
             user_first = update.effective_user.first_name
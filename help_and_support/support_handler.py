@@ -40,7 +40,6 @@ class SupportHandler:
     async def show_support_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ───➤ ست‌کردن state برای بخش Support
         push_state(context, "support_menu")
-        context.user_data['state'] = "support_menu"
 
         chat_id = update.effective_chat.id
         try:
@@ -101,4 +101,6 @@ async def root():
 # ────────────────────────── Local run helper ──────────────────
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8000"))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
+    # loop="uvloop" فقط در همین مسیر اجرای محلی اعمال می‌شود؛ در اجرای CLI
+    # (uvicorn main:app) uvicorn خودش uvloop را در صورت نصب‌بودن انتخاب می‌کند
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False, loop="uvloop")
@@ -2,15 +2,23 @@
 
 # myproject_database.py
 
+import asyncio
+import contextlib
 import logging
 import os
-from datetime import datetime
-from typing import Optional, Dict, Any, List
-
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import PyMongoError, DuplicateKeyError
-from pymongo import ReturnDocument, DESCENDING, ASCENDING
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError, DuplicateKeyError, BulkWriteError
+from pymongo import ReturnDocument, DESCENDING, ASCENDING, UpdateOne, ReadPreference
+from pymongo.read_concern import ReadConcern
 from config import MAIN_LEADER_IDS, SECOND_LEADER_USER_IDS
+from cache import TTLCache, MISS
+
 
 class Database:
     def __init__(self):
@@ -25,11 +33,18 @@ class Database:
             if not db_name:
                 raise ValueError("MONGO_DB_NAME environment variable is not set.")
 
-            self.client = AsyncIOMotorClient(mongo_uri)
+            # کلاینت async بومی PyMongo (جایگزین Motor که deprecated شده است)
+            self.client = AsyncMongoClient(
+                mongo_uri,
+                maxPoolSize=200,                 # عملیات هم‌زمان بیشتر بدون اتصال جدید
+                minPoolSize=20,                  # اتصال‌های گرم از ابتدا
+                maxIdleTimeMS=60_000,
+                serverSelectionTimeoutMS=3_000,
+                compressors="zstd,snappy,zlib",  # zstandard/python-snappy از pymongo[zstd,snappy]؛ zlib fallback
+            )
             self.db = self.client[db_name]
 
             self.collection_users             =     self.db["users"]
-            self.collection_languages         =     self.db["user_languages"]
             self.collection_translation_cache =     self.db["translation_cache"]
             self.collection_payments          =     self.db["payments"]
             
@@ -46,12 +61,62 @@ class Database:
             self.collection_user_payments     =     self.db["user_payments"]
             # در init دیتابیس اضافه کن مثل بقیه
 
+            # هندل‌های فقط‌خواندنی برای کوئری‌هایی که کمی تأخیر را تحمل می‌کنند
+            # (زبان، پروفایل، زیرمجموعه‌ها، کش ترجمه، تاریخچهٔ کیف‌پول) → بار از روی primary برداشته می‌شود
+            ro_options = dict(
+                read_preference=ReadPreference.SECONDARY_PREFERRED,
+                read_concern=ReadConcern("local"),
+            )
+            self._users_ro             = self.collection_users.with_options(**ro_options)
+            self._translation_cache_ro = self.collection_translation_cache.with_options(**ro_options)
+            self._wallet_events_ro     = self.collection_wallet_events.with_options(**ro_options)
+
+            # کش‌های درون‌حافظه‌ای (کلید: user_id) جلوی find_one های پرتکرار
+            self._lang_cache    = TTLCache(maxsize=10_000, ttl=600)
+            self._wallet_cache  = TTLCache(maxsize=10_000, ttl=600)
+            self._balance_cache = TTLCache(maxsize=10_000, ttl=60)
+
+            # ترجمه‌ها تقریباً تغییرناپذیرند → LRU بزرگ با TTL طولانی؛
+            # نبودِ ترجمه (None) جدا و با TTL کوتاه کش می‌شود
+            self._tr_cache     = TTLCache(maxsize=50_000, ttl=24 * 3600)
+            self._tr_miss      = TTLCache(maxsize=10_000, ttl=60)
+
+            # بافر نوشتن کش ترجمه (cache_key → فیلدها) برای ارسال دسته‌ای با bulk_write
+            self._tcache_buf: Dict[str, Dict[str, Any]] = {}
+            self._tcache_full = asyncio.Event()
+
+            # بافر رویدادهای کیف‌پول (append-only) برای insert_many دسته‌ای
+            self._event_buf: List[Dict[str, Any]] = []
+            self._event_full = asyncio.Event()
+            self._event_failures = 0    # فلاش‌های ناموفق پیاپی (سقف: EVENT_MAX_RETRIES)
+            self._event_retry_at = 0.0  # monotonic؛ backoff تلاش بعدی پس از خطا
+
+            self._flush_tasks: List[asyncio.Task] = []
+
 
             self.logger.info("✅ Database connected successfully.")
 
         except Exception as e:
             self.logger.error(f"❌ Database connection failed: {e}")
             raise
+
+    #-------------------------------------------------------------------------------------   
+    @staticmethod
+    def _utcnow() -> datetime:
+        """
+        زمان فعلی UTC بدون utcnow (deprecated در 3.12).
+        tzinfo حذف می‌شود چون PyMongo تاریخ‌ها را naive برمی‌گرداند و
+        مقایسه با مقادیر خوانده‌شده از DB نباید بین aware/naive بشکند.
+        """
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    #-------------------------------------------------------------------------------------   
+    def invalidate_user_cache(self, user_id: int) -> None:
+        """پاک کردن همهٔ مقادیر کش‌شدهٔ یک کاربر (بعد از هر نوشتن بیرونی)."""
+        self._lang_cache.pop(user_id)
+        self._wallet_cache.pop(user_id)
+        self._balance_cache.pop(user_id)
+
     #-------------------------------------------------------------------------------------   
     async def check_connection(self):
         """Ping MongoDB to ensure it’s up."""
@@ -66,6 +131,9 @@ class Database:
     async def initialize_all_connections(self):
         """Initialize and verify all database connections"""
         try:
+            # AsyncMongoClient اتصال را تنبل باز می‌کند؛ اینجا صریحاً وصل می‌شویم
+            await self.client.aconnect()
+
             # Check main database connection
             await self.check_connection()
             
@@ -74,89 +142,345 @@ class Database:
                 {"_id": "member_no"},
                 {"$setOnInsert": {"seq": 1000}},
                 upsert=True
-            )            
-
-            # ➂ unique index on wallet_address (sparse: only docs that have it)
-            await self.collection_users.create_index(
-                [("wallet_address", ASCENDING)],
-                unique=True,
-                sparse=True,
-                name="unique_wallet_address"
-            )         
-            
-            await self.collection_payments.create_index(
-                [("txid", ASCENDING)],
-                unique=True,
-                name="unique_txid"
-            )            
-           
-            await self.collection_withdrawals.create_index(
-                [("withdraw_id", ASCENDING)],
-                unique=True,
-                name="unique_withdraw_id"
-            )           
-                    
-            await self.collection_slots.create_index(
-                [("slot_id", ASCENDING)],
-                unique=True,
-                name="unique_slot_id"
             )
 
-            # Removed index creation on _id for schedules since _id is unique by default
-            
-            # ایندکس مخصوص leader_payments (ترکیبی از user_id و date برای سریع‌تر پیدا کردن گزارش)
-            await self.collection_leader_payments.create_index(
-                [("leader_user_id", ASCENDING), ("date", DESCENDING)],
-                name="leader_user_id_date_index"
-            )            
-                        
-            # ایندکس مخصوص user_payments (بر اساس user_id و تاریخ نزولی)
-            await self.collection_user_payments.create_index(
-                [("user_id", ASCENDING), ("date", DESCENDING)],
-                name="user_id_date_index"
+            # مهاجرت‌ها پیش از ساخت ایندکس‌ها (داده‌های قدیمی اول اصلاح شوند)
+            # ➋.۱ انتقال یک‌بارهٔ زبان‌ها از user_languages به users
+            await self._migrate_user_languages()
+            # پرکردن یک‌بارهٔ downline_count برای اسناد قدیمی؛ $lookup روی inviter_id
+            # بدون ایندکس برای هر سند یک collection scan است → ایندکس پیش از backfill
+            try:
+                await self.collection_users.create_index(
+                    [("inviter_id", ASCENDING)],
+                    name="inviter_id_index"
+                )
+            except Exception as e:
+                self.logger.error(f"❌ Index creation failed: {e!r}")
+            await self._backfill_downline_counts()
+            # TxIDهای قدیمی با حروف بزرگ → lowercase (شکل canonical در handle_txid)
+            await self._normalize_payment_txids()
+
+            # ایندکس‌ها مستقل‌اند → هم‌زمان با یک gather (زمان ≈ کندترین ایندکس)؛
+            # return_exceptions: شکست یکی (مثلاً DuplicateKey روی داده‌های قدیمی برای
+            # ایندکس unique) راه‌اندازی را متوقف نمی‌کند و بقیه بی‌ناظر رها نمی‌شوند
+            results = await asyncio.gather(
+                # صفحه‌بندی keyset زیرمجموعه‌ها (seek مستقیم روی _id بدون skip)
+                self.collection_users.create_index(
+                    [("inviter_id", ASCENDING), ("_id", ASCENDING)],
+                    name="downline_by_inviter"
+                ),
+
+                # ➂ unique index on wallet_address (partial: only docs with a string address)
+                self._ensure_wallet_index(),
+
+                self.collection_payments.create_index(
+                    [("txid", ASCENDING)],
+                    unique=True,
+                    name="unique_txid"
+                ),
+
+                # بازیابی پرداخت‌های در انتظار پس از restart
+                self.collection_payments.create_index(
+                    [("timestamp", ASCENDING)],
+                    partialFilterExpression={"status": "pending"},
+                    name="pending_payments_by_time"
+                ),
+                self.collection_payments.create_index(
+                    [("timestamp", ASCENDING)],
+                    partialFilterExpression={"status": "confirming"},
+                    name="confirming_payments_by_time"
+                ),
+                # تقسیم‌های کمیسیون ناتمام (sweep در startup)
+                self.collection_payments.create_index(
+                    [("txid", ASCENDING)],
+                    partialFilterExpression={"split_done": False},
+                    name="unsplit_payments"
+                ),
+
+                # قفل اتمیک سفارش در prompt_trade_txid (order_id + status)
+                self.collection_orders.create_index(
+                    [("order_id", ASCENDING), ("status", ASCENDING)],
+                    name="orders_by_id_status"
+                ),
+                # sweep سفارش‌های verifying/settling در startup (resume_trades)
+                self.collection_orders.create_index(
+                    [("status", ASCENDING)],
+                    name="orders_by_status"
+                ),
+
+                self.collection_withdrawals.create_index(
+                    [("withdraw_id", ASCENDING)],
+                    unique=True,
+                    name="unique_withdraw_id"
+                ),
+                # آخرین درخواست برداشت کاربر (get_last_withdraw_request / mark_withdraw_paid)
+                self.collection_withdrawals.create_index(
+                    [("user_id", ASCENDING), ("created_at", DESCENDING)],
+                    name="withdrawals_by_user_time"
+                ),
+                # حداکثر یک درخواست برداشتِ «pending» برای هر کاربر (قانون در لایهٔ ایندکس)
+                self.collection_withdrawals.create_index(
+                    [("user_id", ASCENDING), ("status", ASCENDING)],
+                    unique=True,
+                    partialFilterExpression={"status": "pending"},
+                    name="one_pending_per_user"
+                ),
+
+                self.collection_slots.create_index(
+                    [("slot_id", ASCENDING)],
+                    unique=True,
+                    name="unique_slot_id"
+                ),
+
+                # ایندکس‌های کش ترجمه: جستجوی مستقیم (cache_key) و معکوس (translation + target_lang)
+                self.collection_translation_cache.create_index(
+                    [("cache_key", ASCENDING)],
+                    unique=True,
+                    name="unique_cache_key"
+                ),
+                self.collection_translation_cache.create_index(
+                    [("translation", ASCENDING), ("target_lang", ASCENDING)],
+                    partialFilterExpression={"translation": {"$exists": True}},
+                    name="rev_translation_lookup"
+                ),
+
+                # Removed index creation on _id for schedules since _id is unique by default
+
+                # ایندکس مخصوص leader_payments (ترکیبی از user_id و date برای سریع‌تر پیدا کردن گزارش)
+                self.collection_leader_payments.create_index(
+                    [("leader_user_id", ASCENDING), ("date", DESCENDING)],
+                    name="leader_user_id_date_index"
+                ),
+
+                # تاریخچهٔ کیف‌پول (get_wallet_history: user_id + timestamp نزولی)
+                self.collection_wallet_events.create_index(
+                    [("user_id", ASCENDING), ("timestamp", DESCENDING)],
+                    name="events_by_user_time"
+                ),
+
+                # ایندکس مخصوص user_payments (بر اساس user_id و تاریخ نزولی)
+                self.collection_user_payments.create_index(
+                    [("user_id", ASCENDING), ("date", DESCENDING)],
+                    name="user_id_date_index"
+                ),
+                return_exceptions=True,
             )
-            
-            
+            for res in results:
+                if isinstance(res, Exception):
+                    self.logger.error(f"❌ Index creation failed: {res!r}")
+
+            # شروع فلاشرهای پس‌زمینه (کش ترجمه + رویدادهای کیف‌پول)
+            if not self._flush_tasks:
+                self._flush_tasks = [
+                    asyncio.create_task(self._periodic_flusher(
+                        self._tcache_full, self.TCACHE_FLUSH_INTERVAL, self._flush_translation_cache
+                    )),
+                    asyncio.create_task(self._periodic_flusher(
+                        self._event_full, self.EVENT_FLUSH_INTERVAL, self._flush_wallet_events
+                    )),
+                ]
+
             self.logger.info("All database connections initialized and verified")
         except Exception as e:
             self.logger.error(f"Error initializing database connections: {e}")
             raise
 
+    #-------------------------------------------------------------------------------------   
+    async def _backfill_downline_counts(self) -> None:
+        """
+        برای اسنادی که هنوز downline_count ندارند، شمارنده را سمت سرور
+        (self-$lookup روی inviter_id + $merge) محاسبه و ذخیره می‌کند؛
+        هیچ سندی به کلاینت منتقل نمی‌شود. فقط یک بار اجرا می‌شود (نشانگر در counters).
+        """
+        if await self._migration_done("downline_counts"):
+            return
+        cursor = await self.collection_users.aggregate([
+            {"$match": {"downline_count": {"$exists": False}}},
+            {"$lookup": {
+                "from": self.collection_users.name,
+                "localField": "user_id",
+                "foreignField": "inviter_id",
+                "as": "_kids",
+            }},
+            {"$project": {"downline_count": {"$size": "$_kids"}}},
+            {"$merge": {
+                "into": self.collection_users.name,
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "discard",
+            }},
+        ])
+        await cursor.to_list(length=None)
+        await self._mark_migration_done("downline_counts")
+        self.logger.info("✅ downline_count backfill completed")
+
+    #-------------------------------------------------------------------------------------   
+    async def _migration_done(self, name: str) -> bool:
+        """آیا مهاجرت یک‌بارهٔ name قبلاً کامل شده است؟ (سند نشانگر در counters)"""
+        return await self.collection_counters.find_one({"_id": f"migration:{name}"}) is not None
+
+    async def _mark_migration_done(self, name: str) -> None:
+        """ثبت نشانگر اتمام مهاجرت تا در startupهای بعدی دوباره اجرا نشود."""
+        await self.collection_counters.update_one(
+            {"_id": f"migration:{name}"},
+            {"$setOnInsert": {"done_at": self._utcnow()}},
+            upsert=True
+        )
+
+    #-------------------------------------------------------------------------------------   
+    async def _normalize_payment_txids(self) -> None:
+        """
+        handle_txid هش را lowercase ذخیره و مقایسه می‌کند؛ اسناد قدیمی که با حروف بزرگ
+        ثبت شده‌اند یک بار یکسان‌سازی می‌شوند تا چک تکراری و update_payment_status
+        رویشان کار کند. اگر همان هش با حالت دیگری هم ثبت شده باشد (DuplicateKey)، سند
+        دست‌نخورده می‌ماند و فقط گزارش می‌شود. نشانگر اتمام فقط وقتی ثبت می‌شود که
+        هیچ سندی جا نمانده باشد؛ پس از آن اسکن regex در startupها تکرار نمی‌شود.
+        """
+        if await self._migration_done("lowercase_txids"):
+            return
+        cursor = self.collection_payments.find(
+            {"txid": {"$regex": "[A-F]"}}, {"_id": 1, "txid": 1}
+        )
+        fixed = failed = 0
+        async for doc in cursor:
+            try:
+                await self.collection_payments.update_one(
+                    {"_id": doc["_id"]}, {"$set": {"txid": doc["txid"].lower()}}
+                )
+                fixed += 1
+            except DuplicateKeyError:
+                failed += 1
+                self.logger.warning(
+                    f"⚠️ Payment txid {doc['txid']} also stored in lowercase – left as is"
+                )
+        if fixed:
+            self.logger.info(f"✅ Normalized {fixed} payment TxIDs to lowercase")
+        if not failed:
+            await self._mark_migration_done("lowercase_txids")
+
+    #-------------------------------------------------------------------------------------   
+    async def _ensure_wallet_index(self) -> None:
+        """ایندکس partial-unique آدرس کیف پول (نسخهٔ قدیمی sparse ابتدا حذف می‌شود)."""
+        existing = await self.collection_users.index_information()
+        if existing.get("unique_wallet_address", {}).get("sparse"):
+            # نسخهٔ قدیمی sparse بود؛ با گزینه‌های جدید قابل بازسازی نیست
+            await self.collection_users.drop_index("unique_wallet_address")
+        await self.collection_users.create_index(
+            [("wallet_address", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"wallet_address": {"$type": "string"}},
+            name="unique_wallet_address"
+        )
+
+    #-------------------------------------------------------------------------------------   
+    async def _migrate_user_languages(self) -> None:
+        """
+        زبان کاربران قبلاً در کالکشن جداگانهٔ user_languages بود؛ حالا فیلدی از
+        سند users است. اسناد قدیمی یک بار منتقل و کالکشن قدیمی حذف می‌شود.
+        """
+        legacy = self.db["user_languages"]
+        docs = await legacy.find(
+            {}, {"_id": 0, "user_id": 1, "language": 1, "last_updated": 1}
+        ).to_list(length=None)
+        if not docs:
+            return
+
+        now = self._utcnow()
+        docs = [d for d in docs if "user_id" in d]
+        ops = [
+            UpdateOne(
+                {"user_id": d["user_id"]},
+                {
+                    "$set": {
+                        "language": d.get("language", "en"),
+                        "last_lang_update": d.get("last_updated") or now,
+                    },
+                    # کاربری که فقط زبان داشت، سند کامل (مثل insert_user_if_not_exists) می‌گیرد
+                    "$setOnInsert": self._new_user_defaults(d["user_id"]),
+                },
+                upsert=True,
+            )
+            for d in docs
+        ]
+        if not ops:
+            await legacy.drop()
+            return
+        try:
+            res = await self.collection_users.bulk_write(ops, ordered=False)
+            upserted = res.upserted_ids.items()
+            failed = False
+        except BulkWriteError as e:
+            # ordered=False: بقیهٔ عملیات انجام شده‌اند؛ کالکشن قدیمی نگه داشته می‌شود تا
+            # startup بعدی دوباره تلاش کند (نوشتن‌ها idempotent‌اند) و راه‌اندازی متوقف نشود
+            self.logger.error(
+                f"❌ user_languages migration partially failed: {e.details.get('writeErrors')}"
+            )
+            upserted = ((u["index"], u["_id"]) for u in e.details.get("upserted", []))
+            failed = True
+
+        for index, _id in upserted:
+            await self._assign_member_no(_id, docs[index]["user_id"])
+        if failed:
+            return
+        await legacy.drop()
+        self.logger.info(f"✅ Migrated {len(ops)} user_languages docs into users.")
+
     # ------------------- User Language Management -----------------------
     async def update_user_language(self, chat_id: int, language_code: str):
         """Set or update user's preferred language"""
         try:
-            await self.collection_languages.update_one(
+            res = await self.collection_users.update_one(
                 {"user_id": chat_id},
-                {"$set": {
-                    "language": language_code,
-                    "last_updated": datetime.utcnow()
-                }},
+                {
+                    "$set": {
+                        "language": language_code,
+                        "last_lang_update": self._utcnow()
+                    },
+                    # انتخاب زبان پیش از /start: سند کامل بساز، نه سندی بدون member_no/downline_count
+                    "$setOnInsert": self._new_user_defaults(chat_id),
+                },
                 upsert=True
             )
+            if res.upserted_id is not None:
+                await self._assign_member_no(res.upserted_id, chat_id)
+            self._lang_cache.set(chat_id, language_code)   # write-through (خواندن از secondary ممکن است عقب باشد)
         except Exception as e:
             self.logger.error(f"❌ update_user_language({chat_id}) failed: {e}")
             raise
         
+    #-------------------------------------------------------------------------------------   
+    async def _get_stored_language(self, chat_id: int) -> Optional[str]:
+        """زبان ذخیره‌شده (یا None) – ابتدا از کش، سپس از MongoDB."""
+        cached = self._lang_cache.get(chat_id)
+        if cached is not MISS:
+            return cached
+
+        doc = await self._users_ro.find_one(
+            {"user_id": chat_id}, {"_id": 0, "language": 1}
+        )
+        language = doc.get("language") if doc else None
+        self._lang_cache.set(chat_id, language)
+        return language
+
     #-------------------------------------------------------------------------------------   
     async def get_user_language(self, chat_id: int) -> str:
         """Get stored language for user (fallback: 'en')"""
         try:
-            user = await self.collection_languages.find_one(
-                {"user_id": chat_id}, {"_id": 0, "language": 1}
-            )
-            return user["language"] if user and "language" in user else "en"
+            return await self._get_stored_language(chat_id) or "en"
         except Exception as e:
             self.logger.error(f"❌ get_user_language({chat_id}) failed: {e}")
             return "en"
         
+    #-------------------------------------------------------------------------------------   
+    async def get_known_languages(self) -> List[str]:
+        """کدهای زبانی که کاربران انتخاب کرده‌اند (برای گرم کردن کش ترجمه)."""
+        langs = await self._users_ro.distinct("language", {"language": {"$type": "string"}})
+        return [lang for lang in langs if lang]
+
     #-------------------------------------------------------------------------------------   
     async def is_language_set(self, chat_id: int) -> bool:
         """Check if language was set for this user"""
-        doc = await self.collection_languages.find_one(
-            {"user_id": chat_id}, {"_id": 0, "language": 1}
-        )
-        return bool(doc and doc.get("language"))
+        return bool(await self._get_stored_language(chat_id))
 
     # ------------------- User Profile -----------------------
     async def insert_user(self, chat_id: int, first_name: str):
@@ -166,7 +490,7 @@ class Database:
                 {"user_id": chat_id},
                 {"$set": {
                     "first_name": first_name,
-                    "last_updated": datetime.utcnow()
+                    "last_updated": self._utcnow()
                 }},
                 upsert=True
             )
@@ -175,18 +499,45 @@ class Database:
             raise
         
     #-------------------------------------------------------------------------------------   
-    async def insert_user_if_not_exists(self, chat_id, first_name):
+    def _new_user_defaults(self, chat_id: int, **fields) -> Dict[str, Any]:
+        """
+        فیلدهای $setOnInsert سند تازهٔ users. هر مسیری که با upsert کاربر می‌سازد از
+        همین استفاده می‌کند تا سند ناقص (بدون downline_count و ...) ساخته نشود؛
+        language فقط وقتی اضافه می‌شود که همان update آن را $set نکرده باشد.
+        """
+        return {
+            "user_id": chat_id,
+            "promoted_language": False,  # ← فلگ جدید
+            "downline_count": 0,         # شمارندهٔ denormalized زیرمجموعه‌ها
+            "created_at": self._utcnow(),
+            **fields,
+        }
+
+    async def _assign_member_no(self, _id, chat_id: int) -> None:
+        """
+        member_no دقیقاً هنگام ساخت سند اختصاص می‌یابد (فقط برای کاربر تازه،
+        تا شمارنده برای کاربران موجود بی‌دلیل بالا نرود).
+        """
+        member_no = await self._generate_member_no(chat_id)
         await self.collection_users.update_one(
+            {"_id": _id, "member_no": {"$exists": False}},
+            {"$set": {"member_no": member_no}}
+        )
+
+    async def insert_user_if_not_exists(self, chat_id, first_name):
+        res = await self.collection_users.update_one(
             {"user_id": chat_id},
-            {"$setOnInsert": {
-                "user_id": chat_id,
-                "first_name": first_name,
-                "language": "en",            # هرچی پیش‌فرض داشتی
-                "promoted_language": False,  # ← فلگ جدید
-                "created_at": datetime.utcnow()
-            }},
+            {"$setOnInsert": self._new_user_defaults(
+                chat_id,
+                first_name=first_name,
+                language="en",               # هرچی پیش‌فرض داشتی
+            )},
             upsert=True
         )
+        self._lang_cache.pop(chat_id)
+
+        if res.upserted_id is not None:
+            await self._assign_member_no(res.upserted_id, chat_id)
         
     #-------------------------------------------------------------------------------------   
     async def is_language_prompt_done(self, chat_id) -> bool:
@@ -200,37 +551,81 @@ class Database:
             {"user_id": chat_id},
             {"$set": {"promoted_language": True}}
         )
+        self._lang_cache.pop(chat_id)
 
     # ------------------- Translation Cache -----------------------
+    TCACHE_FLUSH_INTERVAL = 0.05     # ثانیه
+    TCACHE_MAX_BATCH      = 100
+
     async def get_cached_translation(self, text: str, target_lang: str) -> Optional[str]:
         try:
             key = f"{text}_{target_lang}"
-            doc = await self.collection_translation_cache.find_one({"cache_key": key})
-            if doc:
-                return doc.get("translation")
-            return None
+            cached = self._tr_cache.get(key)
+            if cached is not MISS:
+                return cached
+            if self._tr_miss.get(key) is not MISS:
+                return None
+
+            # ترجمه‌ای که هنوز در بافر است (فلاش نشده)
+            pending = self._tcache_buf.get(key)
+            if pending is not None:
+                return pending["translation"]
+
+            doc = await self._translation_cache_ro.find_one(
+                {"cache_key": key}, {"_id": 0, "translation": 1}
+            )
+            translation = doc.get("translation") if doc else None
+            if translation is None:
+                self._tr_miss.set(key, None)
+            else:
+                self._tr_cache.set(key, translation)
+            return translation
         except PyMongoError as e:
             self.logger.error(f"❌ Error getting cached translation: {e}")
             return None
         
     #-------------------------------------------------------------------------------------   
     async def update_translation_cache(self, text: str, target_lang: str, translation: str):
+        """
+        نوشتن در LRU درون‌حافظه و بافر؛ فلاشر پس‌زمینه هر TCACHE_FLUSH_INTERVAL
+        ثانیه (یا با رسیدن به TCACHE_MAX_BATCH) همه را با یک bulk_write می‌فرستد.
+        """
+        key = f"{text}_{target_lang}"
+        self._tr_cache.set(key, translation)
+        self._tr_miss.pop(key)
+        self._tcache_buf[key] = {
+            "original_text": text,
+            "target_lang": target_lang,
+            "translation": translation,
+            "timestamp": self._utcnow()
+        }
+        if len(self._tcache_buf) >= self.TCACHE_MAX_BATCH:
+            self._tcache_full.set()
+
+    #-------------------------------------------------------------------------------------   
+    async def _flush_translation_cache(self) -> None:
+        """ارسال دسته‌ای بافر کش ترجمه (بافر قبل از await جابه‌جا می‌شود)."""
+        if not self._tcache_buf:
+            return
+        pending, self._tcache_buf = self._tcache_buf, {}
+        batch = [
+            UpdateOne({"cache_key": key}, {"$set": fields}, upsert=True)
+            for key, fields in pending.items()
+        ]
         try:
-            key = f"{text}_{target_lang}"
-            await self.collection_translation_cache.update_one(
-                {"cache_key": key},
-                {
-                    "$set": {
-                        "original_text": text,
-                        "target_lang": target_lang,
-                        "translation": translation,
-                        "timestamp": datetime.utcnow()
-                    }
-                },
-                upsert=True
-            )
+            await self.collection_translation_cache.bulk_write(batch, ordered=False)
         except PyMongoError as e:
             self.logger.error(f"❌ Error updating translation cache: {e}")
+
+    #-------------------------------------------------------------------------------------   
+    @staticmethod
+    async def _periodic_flusher(wake: asyncio.Event, interval: float, flush) -> None:
+        """هر interval ثانیه (یا زودتر با set شدن wake) تابع flush را اجرا می‌کند."""
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(wake.wait(), interval)
+            wake.clear()
+            await flush()
             
     #-------------------------------------------------------------------------------------   
     async def get_original_text_by_translation(self, translated_text: str, target_lang: str) -> Optional[str]:
@@ -243,7 +638,7 @@ class Database:
             return None
 
         if self.collection_translation_cache is not None:
-            doc = await self.collection_translation_cache.find_one({
+            doc = await self._translation_cache_ro.find_one({
                 "translation": translated_text,
                 "target_lang": target_lang
             })
@@ -253,46 +648,14 @@ class Database:
 
         return None
 
-# -------------------------------------------------------------
-    async def get_user_balance(self, user_id: int) -> int:
-        """
-        برگرداندن موجودی توکن کاربر.
-
-        Args:
-            user_id (int): آیدی عددی تلگرام کاربر.
-
-        Returns:
-            int: تعداد توکن‌های کاربر (۰ اگر کاربر یا فیلد وجود نداشته باشد).
-        """
-        # فرض می‌کنیم collection_users قبلاً در __init__ مقداردهی شده است
-        doc = await self.collection_users.find_one(
-            {"user_id": user_id},
-            {"_id": 0, "tokens": 1}
-        )
-        return int(doc.get("tokens", 0)) if doc else 0
-# -------------------------------------------------------------
-
-    async def adjust_balance(self, user_id: int, delta: int):
-        """
-        افزایش یا کاهش موجودی کاربر.
-
-        delta می‌تواند منفی باشد.
-        """
-        await self.collection_users.update_one(
-            {"user_id": user_id},
-            {"$inc": {"tokens": delta}},
-            upsert=True
-        )
-
-    async def set_balance(self, user_id: int, new_balance: int):
-        """تنظیم مستقیم موجودی به مقدار مشخص."""
-        await self.collection_users.update_one(
-            {"user_id": user_id},
-            {"$set": {"tokens": max(0, new_balance)}},
-            upsert=True
-        )
 ############---------------------------------------------------------------------------------------     
-    async def store_payment_txid(self, user_id: int, txid: str) -> None:
+    async def store_payment_txid(
+        self,
+        user_id: int,
+        txid: str,
+        inviter_id: Optional[int] = None,
+        first_name: Optional[str] = None,
+    ) -> None:
         """
         ذخیره‌ی Hash تراکنش (TxID) برای پرداخت join fee.
 
@@ -303,34 +666,103 @@ class Database:
               - txid:     رشته‌ی هش تراکنش
               - timestamp: تاریخ و ساعت درج (UTC)
               - status:   "pending"  (برای پیگیری وضعیت تأیید)
+              - inviter_id / first_name: برای ادامهٔ پایش پس از restart
          2) اجازه می‌دهد بعداً در webhook یا مانیتور کریپتو،
             همین سند را با وضعیت "confirmed" یا "failed" به‌روز کنید.
         """
         await self.collection_payments.insert_one({
             "user_id":    user_id,
             "txid":       txid,
-            "timestamp":  datetime.utcnow(),
-            "status":     "pending"
+            "timestamp":  self._utcnow(),
+            "status":     "pending",
+            "inviter_id": inviter_id,
+            "first_name": first_name,
         })    
-            
+
     #-----------------------------------------------------------------------------
-    async def update_payment_status(self, txid: str, status: str) -> None:
+    async def try_store_payment_txid(
+        self,
+        user_id: int,
+        txid: str,
+        inviter_id: Optional[int] = None,
+        first_name: Optional[str] = None,
+    ) -> bool:
+        """
+        چک تکراری‌بودن + درج در یک رفت‌وبرگشت (بدون TOCTOU):
+        ایندکس unique_txid تکراری را رد می‌کند → False، درج موفق → True.
+        """
+        try:
+            await self.store_payment_txid(user_id, txid, inviter_id, first_name)
+            return True
+        except DuplicateKeyError:
+            return False
+
+    #-----------------------------------------------------------------------------
+    async def update_payment_status(
+        self, txid: str, status: str, expected: Optional[str] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> bool:
         """
         به‌روزرسانی وضعیت سند پرداخت:
         - txid: Hash تراکنش
-        - status: 'confirmed' یا 'failed'
+        - status: 'confirming'، 'confirmed' یا 'failed'
+        - expected: اگر داده شود فقط از این وضعیت گذار انجام می‌شود (مثلاً 'pending')
+        - extra: فیلدهای دیگری که در همین گذار ست می‌شوند
+        خروجی: True اگر سند واقعاً تغییر کرد.
         """
-        await self.collection_payments.update_one(
-            {"txid": txid},
+        query: Dict[str, Any] = {"txid": txid}
+        if expected is not None:
+            query["status"] = expected
+        res = await self.collection_payments.update_one(
+            query,
             {"$set": {
                 "status": status,
-                "updated_at": datetime.utcnow()
+                "updated_at": self._utcnow(),
+                **(extra or {}),
             }}
         )
+        return res.modified_count == 1
+    #-----------------------------------------------------------------------------
+    async def recent_txids(self, limit: int = 65_536) -> List[str]:
+        """آخرین TxIDهای ثبت‌شده (جدیدترین اول) برای گرم کردن فیلتر درون‌حافظه."""
+        cursor = self.collection_payments.find(
+            {}, {"_id": 0, "txid": 1}
+        ).sort("timestamp", DESCENDING).limit(limit)
+        return [d["txid"] async for d in cursor if "txid" in d]
+
+    #-----------------------------------------------------------------------------
+    async def iter_pending_payments(
+        self, since: Optional[datetime] = None, status: str = "pending"
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        پرداخت‌های join-fee با وضعیت status (pending: منتظر فید، confirming: ادعاشده ولی
+        نهایی‌نشده) که بعد از since ثبت شده‌اند – برای ادامهٔ کار پس از restart.
+        """
+        query: Dict[str, Any] = {"status": status}
+        if since is not None:
+            query["timestamp"] = {"$gte": since}
+        cursor = self.collection_payments.find(
+            query,
+            {"_id": 0, "user_id": 1, "txid": 1, "timestamp": 1, "inviter_id": 1, "first_name": 1},
+        )
+        async for doc in cursor:
+            yield doc
+
+    #-----------------------------------------------------------------------------
+    async def iter_unsplit_payments(self) -> AsyncIterator[Dict[str, Any]]:
+        """پرداخت‌های join-fee ادعاشده که تقسیم کمیسیونشان هنوز کامل نشده (split_done=False)."""
+        cursor = self.collection_payments.find(
+            {"split_done": False, "status": {"$in": ["confirming", "confirmed"]}},
+            {"_id": 0, "user_id": 1, "txid": 1, "status": 1},
+        )
+        async for doc in cursor:
+            yield doc
+
     #-----------------------------------------------------------------------------
     async def is_txid_used(self, txid: str) -> bool:
         """Return True if this TxID already exists in payments."""
-        return await self.collection_payments.count_documents({"txid": txid}) > 0
+        # find_one روی ایندکس unique_txid با اولین تطابق متوقف می‌شود
+        return (await self.collection_payments.find_one({"txid": txid}, {"_id": 1})) is not None
 
 ############################################################################################################
 
@@ -362,7 +794,7 @@ class Database:
             "tx_hash": tx_hash,
             "pool_type": pool_type,
             "payout_period": payout_period,
-            "date": date or datetime.utcnow()
+            "date": date or self._utcnow()
         }
         await self.collection_leader_payments.insert_one(record)
 
@@ -378,7 +810,8 @@ class Database:
         if not is_manager:
             return []  # اگر مدیر نبود، چیزی برنگرداند
         cursor = self.collection_leader_payments.find(
-            {"user_id": user_id}
+            {"user_id": user_id},
+            {"_id": 0}
         ).sort("date", -1).limit(limit)
         return await cursor.to_list(length=limit)
 
@@ -400,7 +833,7 @@ class Database:
             "wallet": wallet,
             "tx_hash": tx_hash,
             "payment_type": payment_type,
-            "date": date or datetime.utcnow(),
+            "date": date or self._utcnow(),
         }
         await self.collection_user_payments.insert_one(doc)
 
@@ -433,6 +866,8 @@ class Database:
     # ------------------- Profile & Referral helpers -----------------------
 
     async def get_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
+        # روی primary: فراخواننده‌ها معمولاً بلافاصله پس از نوشتن (insert_user_if_not_exists،
+        # ensure_user) می‌خوانند و secondary عقب‌مانده ممکن است None برگرداند
         doc = await self.collection_users.find_one(
             {"user_id": user_id},
             {
@@ -444,29 +879,45 @@ class Database:
                 "balance_usd":    1,      # ← NEW
                 "commission_usd": 1,
                 "joined":         1,
+                "language":       1,
+                "downline_count": 1,      # شمارندهٔ denormalized (در ثبت‌نام ++ می‌شود)
             },
         )
         if doc is None:
             return None
 
-        # اگر member_no هنوز ست نشده باشد
+        # member_no در insert_user_if_not_exists اختصاص می‌یابد؛ این شاخه فقط
+        # برای اسناد قدیمی/ساخته‌شده از مسیرهای دیگر است
         if "member_no" not in doc:
-            doc["member_no"] = await self._generate_member_no(user_id)
+            new_no = await self._generate_member_no(user_id)
+            updated = await self.collection_users.find_one_and_update(
+                {"user_id": user_id, "member_no": {"$exists": False}},
+                {"$set": {"member_no": new_no}},
+                projection={"_id": 0, "member_no": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if updated is None:   # درخواست هم‌زمان زودتر ست کرده است
+                updated = await self.collection_users.find_one(
+                    {"user_id": user_id}, {"_id": 0, "member_no": 1}
+                ) or {}
+            doc["member_no"] = updated.get("member_no", new_no)
+
+        # تعداد زیرمجموعه‌ها – فقط برای اسناد قدیمی که شمارنده ندارند یک بار شمرده و ذخیره می‌شود
+        if "downline_count" not in doc:
+            doc["downline_count"] = await self.collection_users.count_documents(
+                {"inviter_id": user_id}
+            )
             await self.collection_users.update_one(
-                {"user_id": user_id},
-                {"$set": {"member_no": doc["member_no"]}}
+                {"user_id": user_id, "downline_count": {"$exists": False}},
+                {"$set": {"downline_count": doc["downline_count"]}}
             )
 
-        # تعداد زیرمجموعه‌ها
-        doc["downline_count"] = await self.collection_users.count_documents(
-            {"inviter_id": user_id}
-        )
-
         # پیش‌فرض‌ها
         doc.setdefault("tokens", 0)
         doc.setdefault("balance_usd", 0.0)
         doc.setdefault("commission_usd", 0.0)
         doc.setdefault("joined", False)
+        doc.setdefault("language", "en")
 
         # تبدیل Decimal → float
         doc["balance_usd"]    = float(doc["balance_usd"])
@@ -476,23 +927,53 @@ class Database:
     async def get_downline(
         self,
         user_id: int,
-        page: int = 1,
+        after_id: Optional[str] = None,
+        before_id: Optional[str] = None,
         page_size: int = 30,
-    ) -> List[Dict[str, Any]]:
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
         """
-        فهرست زیرمجموعه‌های مستقیم کاربر، به‌صورت صفحه‌بندی.
+        فهرست زیرمجموعه‌های مستقیم کاربر، با صفحه‌بندی keyset روی `_id`.
+
+        • after_id  → صفحهٔ بعد از این کرسر
+        • before_id → صفحهٔ قبل از این کرسر
+        • هیچ‌کدام  → صفحهٔ اول
+
+        Returns
+        -------
+        (members, first_cursor, last_cursor)
+            کرسرها رشته‌های opaque هستند و برای صفحهٔ قبل/بعد برگردانده می‌شوند.
         """
         try:
-            skip = max(0, (page - 1) * page_size)
+            query: Dict[str, Any] = {"inviter_id": user_id}
+            direction = ASCENDING
+            try:
+                if after_id:
+                    query["_id"] = {"$gt": ObjectId(after_id)}
+                elif before_id:
+                    query["_id"] = {"$lt": ObjectId(before_id)}
+                    direction = DESCENDING
+            except InvalidId:
+                pass   # کرسر نامعتبر → صفحهٔ اول
+
             cursor = (
-                self.collection_users.find(
-                    {"inviter_id": user_id},
-                    {"_id": 0, "first_name": 1, "referral_code": 1},
+                self._users_ro.find(
+                    query,
+                    {"_id": 1, "first_name": 1, "referral_code": 1},
                 )
-                .skip(skip)
+                .sort("_id", direction)
                 .limit(page_size)
             )
-            return await cursor.to_list(length=page_size)
+            docs = await cursor.to_list(length=page_size)
+            if direction == DESCENDING:
+                docs.reverse()
+            if not docs:
+                return [], None, None
+
+            first_cursor = str(docs[0]["_id"])
+            last_cursor = str(docs[-1]["_id"])
+            for d in docs:
+                d.pop("_id", None)
+            return docs, first_cursor, last_cursor
         except Exception as e:
             self.logger.error(f"❌ get_downline({user_id}) failed: {e}")
             raise
@@ -514,7 +995,7 @@ class Database:
     #----------------------------------------------------------------------------------------
     # موجودی دلاری (پس از فروش توکن)
     async def get_fiat_balance(self, user_id: int) -> float:
-        doc = await self.collection_users.find_one({"user_id": user_id}, {"usd_balance": 1})
+        doc = await self.collection_users.find_one({"user_id": user_id}, {"_id": 0, "usd_balance": 1})
         return float(doc.get("usd_balance", 0)) if doc else 0.0
     
     #-------------------------------------------------------------------------------------   
@@ -534,18 +1015,39 @@ class Database:
 
     # ─────────────────────── Referral helpers ────────────────────────
     async def get_downline_count(self, user_id: int) -> int:
-        """تعداد مستقیم‌ترین زیرمجموعه‌های کاربر."""
-        return await self.collection_users.count_documents({"parent_id": user_id})
+        """
+        تعداد مستقیم‌ترین زیرمجموعه‌های کاربر.
+        از شمارندهٔ denormalized «children_count» روی سند والد خوانده می‌شود؛
+        فقط اگر هنوز وجود نداشت یک بار شمرده و ذخیره می‌شود.
+        """
+        doc = await self.collection_users.find_one(
+            {"user_id": user_id}, {"_id": 0, "children_count": 1}
+        )
+        if doc and "children_count" in doc:
+            return int(doc["children_count"])
+
+        count = await self.collection_users.count_documents({"parent_id": user_id})
+        await self.collection_users.update_one(
+            {"user_id": user_id, "children_count": {"$exists": False}},
+            {"$set": {"children_count": count}}
+        )
+        return count
 
     async def clear_downline(self, user_id: int) -> None:
         """
         والدِ تمام زیرمجموعه‌های مستقیم را خالی می‌کند.
         همچنین می‌توانید به دلخواه، رکوردی در لاگ نگه دارید.
         """
-        await self.collection_users.update_many(
+        res = await self.collection_users.update_many(
             {"parent_id": user_id},
             {"$set": {"parent_id": None}}
         )
+        # شمارنده دقیقاً به اندازهٔ فرزندانی که جدا شدند کم می‌شود
+        if res.modified_count:
+            await self.collection_users.update_one(
+                {"user_id": user_id, "children_count": {"$exists": True}},
+                {"$inc": {"children_count": -res.modified_count}}
+            )
 
     async def mark_membership_withdrawn(self, user_id: int) -> None:
         """
@@ -555,7 +1057,7 @@ class Database:
         await self.collection_users.update_one(
             {"user_id": user_id},
             {"$set": {"joined": False, "membership_withdrawn": True,
-                      "withdrawn_at": datetime.utcnow()}}
+                      "withdrawn_at": self._utcnow()}}
         )
 
     # ─────────────────── Withdrawal life-cycle helpers ───────────────
@@ -568,7 +1070,7 @@ class Database:
         """
         update_doc: Dict[str, Any] = {
             "status": status,
-            "updated_at": datetime.utcnow(),
+            "updated_at": self._utcnow(),
         }
         if txid:
             update_doc["txid"] = txid
@@ -579,10 +1081,22 @@ class Database:
         )
 
     # (اختیاری) اگر می‌خواهید برداشت‌های باز را استریم کنید
-    async def get_pending_withdrawals(self) -> List[Dict[str, Any]]:
-        """برمی‌گرداند تمام درخواست‌های برداشت با status='pending'."""
-        cursor = self.collection_withdrawals.find({"status": "pending"})
-        return await cursor.to_list(length=None)
+    async def iter_pending_withdrawals(
+        self, batch_size: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        درخواست‌های برداشت با status='pending' را یکی‌یکی yield می‌کند
+        (دسته‌های batch_size تایی از سرور؛ کل نتیجه در حافظه نگه داشته نمی‌شود).
+
+            async for w in db.iter_pending_withdrawals():
+                ...
+        """
+        cursor = self.collection_withdrawals.find(
+            {"status": "pending"},
+            {"_id": 0, "withdraw_id": 1, "user_id": 1, "address": 1, "amount": 1},
+        ).batch_size(batch_size)
+        async for doc in cursor:
+            yield doc
     
     async def mark_withdraw_failed(self, chat_id: int, reason: str) -> None:
         """
@@ -593,7 +1107,7 @@ class Database:
             {"$set": {
                 "status": "failed",
                 "fail_reason": reason,
-                "updated_at": datetime.utcnow(),
+                "updated_at": self._utcnow(),
             }}
         )    
     
@@ -612,10 +1126,12 @@ class Database:
                 "$set": {
                     "status": "paid",
                     "tx_id": tx_id,
-                    "paid_at": datetime.utcnow(),
+                    "paid_at": self._utcnow(),
                 }
             },
             sort=[("created_at", -1)],
+            projection={"_id": 0, "withdraw_id": 1, "user_id": 1, "amount": 1,
+                        "address": 1, "status": 1, "tx_id": 1, "paid_at": 1},
             return_document=ReturnDocument.AFTER,
         )
         return updated
@@ -631,7 +1147,9 @@ class Database:
         """
         درج ایمن یک درخواست برداشت جدید.
 
-        ● اگر همان کاربر هنوز درخواست «pending» داشته باشد → خطا.
+        ● اگر همان کاربر هنوز درخواست «pending» داشته باشد → خطا
+          (ایندکس partial-unique «one_pending_per_user» آن را تضمین می‌کند؛
+          دیگر پیش‌بررسی find_one لازم نیست).
         ● شناسهٔ یکتا (auto-increment) با کلید `withdraw_id`.
         ● در صورت بروز حذف هم‌زمان (race condition) روی همان id،
         DuplicateKeyError گرفته و مجدداً تلاش می‌شود.
@@ -641,14 +1159,8 @@ class Database:
         wid : int
             شمارهٔ یکتای درخواست برداشت.
         """
-        # ➊ آیا قبلاً درخواست باز دارد؟
-        existing = await self.collection_withdrawals.find_one(
-            {"user_id": user_id, "status": "pending"}
-        )
-        if existing:
-            raise ValueError("pending_withdraw_exists")
-
-        # ➋ حلقهٔ امن برای ایجاد ID یکتا
+        # حلقهٔ امن برای ایجاد ID یکتا
+        now = self._utcnow()
         for _ in range(3):                         # حداکثر ۳ بار تلاش
             wid = await self._get_next_sequence("withdraw_id")
             try:
@@ -659,12 +1171,16 @@ class Database:
                         "amount":       amount,
                         "address":      address,
                         "status":       "pending",
-                        "requested_at": datetime.utcnow(),
+                        "requested_at": now,
+                        "created_at":   now,       # فیلد مرتب‌سازی در کوئری‌های «آخرین درخواست»
                     }
                 )
                 return wid                         # موفقیت ☑
-            except DuplicateKeyError:
-                # در شرایط رقابتی نادر رخ می‌دهد؛ تکرار حلقه
+            except DuplicateKeyError as e:
+                # ➊ کاربر از قبل درخواست باز دارد
+                if "one_pending_per_user" in str(e):
+                    raise ValueError("pending_withdraw_exists") from e
+                # ➋ تصادم withdraw_id؛ در شرایط رقابتی نادر رخ می‌دهد؛ تکرار حلقه
                 continue
 
         # اگر به اینجا برسیم یعنی بعد از ۳ تلاش هنوز موفق نشدیم
@@ -681,6 +1197,7 @@ class Database:
         """
         return await self.collection_withdrawals.find_one(
             {"user_id": user_id},
+            {"_id": 0, "withdraw_id": 1, "status": 1, "amount": 1, "created_at": 1},
             sort=[("created_at", -1)]
         )
 
@@ -690,13 +1207,14 @@ class Database:
     # ── ایجاد سفارش فروش ───────────────────────────────────────────────
     async def create_sell_order(self, order: dict) -> int:
         seq = await self._get_next_sequence("order_id")      # ← همین شمارنده را
+        now = self._utcnow()
         order.update({
             "order_id":   seq,
             "side":       "sell",        # تمایز جهت سفارش (اختیاری)
             "status":     "open",
             "remaining":  order["amount"],
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
+            "created_at": now,
+            "updated_at": now,
         })
         await self.collection_orders.insert_one(order)
         return seq
@@ -704,42 +1222,53 @@ class Database:
     # ── ایجاد سفارش خرید ───────────────────────────────────────────────
     async def create_buy_order(self, order: dict) -> int:
         seq = await self._get_next_sequence("order_id")      # ← همان شمارنده
+        now = self._utcnow()
         order.update({
             "order_id":   seq,
             "side":       "buy",
             "status":     "open",
             "remaining":  order["amount"],
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
+            "created_at": now,
+            "updated_at": now,
         })
         await self.collection_orders.insert_one(order)
         return seq
  
 
     # ─── انتقال توکن بین دو کاربر (اتمیک) ───────────────────────────────
-    async def transfer_tokens(self, seller_id: int, buyer_id: int, amount: int):
+    async def transfer_tokens(self, seller_id: int, buyer_id: int, amount: float):
         """
         کسر از seller و افزودن به buyer به‌صورت تراکنش اتمیک.
-        موجودی کاربران در فیلد «tokens» نگه‌داری می‌شود.
-        """
-        async with await self.client.start_session() as session:
-            async with session.start_transaction():
-                # ➊ کسر از فروشنده (اگر کافی نباشد exc بالا می‌آید)
-                res = await self.collection_users.update_one(
-                    {"user_id": seller_id, "tokens": {"$gte": amount}},
-                    {"$inc": {"tokens": -amount}},
+        موجودی کاربران در فیلد «tokens» (double) نگه‌داری می‌شود.
+        """
+        amount = float(amount)
+        async with self.client.start_session() as session:
+            async with await session.start_transaction():
+                # هر دو عملیات در یک پیام bulk_write (یک رفت‌وبرگشت به‌جای دو)
+                res = await self.collection_users.bulk_write(
+                    [
+                        # ➊ کسر از فروشنده (فقط اگر موجودی کافی باشد)
+                        UpdateOne(
+                            {"user_id": seller_id, "tokens": {"$gte": amount}},
+                            {"$inc": {"tokens": -amount}},
+                        ),
+                        # ➋ افزودن به خریدار (اگر کاربر وجود نداشت ساخته می‌شود)
+                        UpdateOne(
+                            {"user_id": buyer_id},
+                            {"$inc": {"tokens": amount}},
+                            upsert=True,
+                        ),
+                    ],
+                    ordered=True,
                     session=session,
                 )
-                if res.modified_count != 1:
+                # خریدار یا match شده یا upsert؛ پس سهم فروشنده = matched + upserted - 1
+                if res.matched_count + res.upserted_count - 1 != 1:
+                    # raise داخل تراکنش → abort و برگشت افزایش خریدار
                     raise ValueError("Seller balance insufficient")
 
-                # ➋ افزودن به خریدار (اگر کاربر وجود نداشت ساخته می‌شود)
-                await self.collection_users.update_one(
-                    {"user_id": buyer_id},
-                    {"$inc": {"tokens": amount}},
-                    upsert=True,
-                    session=session,
-                )
+        self._balance_cache.pop(seller_id)
+        self._balance_cache.pop(buyer_id)
 
     #-------------------------------------------------------------------------------------   
     async def set_wallet_address(self, user_id: int, address: str) -> None:
@@ -749,15 +1278,22 @@ class Database:
             {"$set": {"wallet_address": address}},
             upsert=True
         )
+        self._wallet_cache.set(user_id, address)   # write-through
         
     #-------------------------------------------------------------------------------------   
     async def get_wallet_address(self, user_id: int) -> str | None:
         """بازیابی آدرس کیف پول کاربر یا None اگر ذخیره نشده باشد."""
+        cached = self._wallet_cache.get(user_id)
+        if cached is not MISS:
+            return cached
+
         doc = await self.collection_users.find_one(
             {"user_id": user_id},
-            {"wallet_address": 1}
+            {"_id": 0, "wallet_address": 1}
         )
-        return doc.get("wallet_address") if doc else None
+        address = doc.get("wallet_address") if doc else None
+        self._wallet_cache.set(user_id, address)
+        return address
     
     #-------------------------------------------------------------------------------------   
     async def get_user_by_wallet(self, address: str) -> Optional[int]:
@@ -773,55 +1309,151 @@ class Database:
     # ── مدیریت موجودی و تاریخچه ─────────────────────────────────
     async def get_user_balance(self, user_id: int) -> float:
         """موجودی فعلی توکن کاربر (یا ۰.۰ اگر فیلد وجود نداشته باشد)."""
+        cached = self._balance_cache.get(user_id)
+        if cached is not MISS:
+            return cached
+
         doc = await self.collection_users.find_one(
             {"user_id": user_id},
             {"_id": 0, "tokens": 1}
         )
-        return float(doc.get("tokens", 0.0)) if doc else 0.0
+        balance = float(doc.get("tokens", 0.0)) if doc else 0.0
+        self._balance_cache.set(user_id, balance)
+        return balance
     
     #-------------------------------------------------------------------------------------   
     async def adjust_balance(self, user_id: int, delta: float):
         """اضافه یا کم کردن اتمیک مقدار delta در موجودی."""
+        # همیشه double → $inc در جا انجام می‌شود و نوع BSON فیلد تغییر نمی‌کند
         await self.collection_users.update_one(
             {"user_id": user_id},
-            {"$inc": {"tokens": delta}},
+            {"$inc": {"tokens": float(delta)}},
             upsert=True
         )
+        self._balance_cache.pop(user_id)
+
+    #-------------------------------------------------------------------------------------   
+    async def set_balance(self, user_id: int, new_balance: float):
+        """تنظیم مستقیم موجودی به مقدار مشخص."""
+        await self.collection_users.update_one(
+            {"user_id": user_id},
+            {"$set": {"tokens": max(0.0, float(new_balance))}},
+            upsert=True
+        )
+        self._balance_cache.pop(user_id)
         
     #-------------------------------------------------------------------------------------   
+    EVENT_FLUSH_INTERVAL = 0.2       # ثانیه
+    EVENT_MAX_BATCH      = 200
+    EVENT_MAX_RETRIES    = 5         # فلاش ناموفق پیاپی؛ بعد از آن بافر دور ریخته و لاگ می‌شود
+
     async def record_wallet_event(
         self, user_id: int, amount: float, event_type: str, description: str = ""
     ) -> None:
         """
         ثبت هر تغییر در موجودی:
         event_type مثل "referral_reward" یا "manual_adjustment"
+
+        رویداد فقط در بافر قرار می‌گیرد؛ فلاشر پس‌زمینه هر EVENT_FLUSH_INTERVAL
+        ثانیه (یا با رسیدن به EVENT_MAX_BATCH) با یک insert_many ذخیره می‌کند.
         """
-        await self.collection_wallet_events.insert_one({
+        self._event_buf.append({
             "user_id":     user_id,
             "amount":      amount,
             "event_type":  event_type,
             "description": description,
-            "timestamp":   datetime.utcnow()
+            "timestamp":   self._utcnow()
         })
+        if len(self._event_buf) >= self.EVENT_MAX_BATCH:
+            self._event_full.set()
 
+    #-------------------------------------------------------------------------------------   
+    async def _flush_wallet_events(self, force: bool = False) -> bool:
+        """
+        ارسال بافر با یک insert_many؛ در خطای گذرا سندهای ارسال‌نشده به ابتدای بافر
+        برمی‌گردند تا فلاش بعدی دوباره بفرستد. خروجی: True اگر بافر خالی شد.
+
+        _id هر سند را insert_many سمت کلاینت می‌گذارد → سندی که در تلاش قبلی واقعاً ذخیره
+        شده بود، در تلاش بعدی DuplicateKey (11000) می‌گیرد و موفق حساب می‌شود.
+        """
+        if not self._event_buf:
+            return True
+        if not force and time.monotonic() < self._event_retry_at:
+            return False        # هنوز در backoff پس از خطای قبلی
+        batch, self._event_buf = self._event_buf, []
+        try:
+            await self.collection_wallet_events.insert_many(batch, ordered=False)
+            self._event_failures = 0
+            return True
+        except BulkWriteError as e:
+            # ordered=False: فقط سندهای writeErrors ذخیره نشده‌اند
+            errors = e.details.get("writeErrors", [])
+            unsent = [batch[err["index"]] for err in errors if err.get("code") != 11000]
+            error = e
+        except PyMongoError as e:
+            unsent, error = batch, e
+
+        if not unsent:
+            self._event_failures = 0
+            return True
+
+        self._event_failures += 1
+        if self._event_failures > self.EVENT_MAX_RETRIES:
+            self.logger.error(
+                f"❌ Dropping {len(unsent)} wallet events after "
+                f"{self.EVENT_MAX_RETRIES} failed flushes: {error}"
+            )
+            self._event_failures = 0
+            return False
+
+        self.logger.warning(
+            f"⚠️ Flushing {len(unsent)} wallet events failed "
+            f"(attempt {self._event_failures}/{self.EVENT_MAX_RETRIES}), will retry: {error}"
+        )
+        self._event_buf[:0] = unsent        # ترتیب زمانی حفظ شود
+        self._event_retry_at = time.monotonic() + min(0.5 * 2 ** self._event_failures, 8)
+        return False
+
+    #-------------------------------------------------------------------------------------   
     async def get_wallet_history(
         self, user_id: int, limit: int = 20
     ) -> List[Dict[str, Any]]:
         """بازگرداندن جدیدترین رویدادهای کیف‌پول به ترتیب timestamp نزولی."""
-        cursor = self.collection_wallet_events.find(
+        cursor = self._wallet_events_ro.find(
             {"user_id": user_id},
             {"_id": 0, "amount": 1, "event_type": 1, "description": 1, "timestamp": 1}
         ).sort("timestamp", -1).limit(limit)
-        return await cursor.to_list(length=limit)
+        events = await cursor.to_list(length=limit)
+
+        # رویدادهایی که هنوز در بافر هستند (فلاش نشده) هم نمایش داده شوند
+        pending = [
+            {k: e[k] for k in ("amount", "event_type", "description", "timestamp")}
+            for e in self._event_buf if e["user_id"] == user_id
+        ]
+        if pending:
+            events = sorted(pending + events, key=lambda e: e["timestamp"], reverse=True)[:limit]
+        return events
       
     #------------------------------------------------------------------------------------
     async def close(self):
             """
             بستن اتصال به MongoDB هنگام خاموشی بات
             """
-            # متد closeِ خود MongoClient همگام‌نشده است،
-            # اما می‌توانیم آن را داخل متد async فراخوانی کنیم.
-            self.client.close()
+            # توقف فلاشرها و ارسال باقی‌ماندهٔ بافرها
+            for task in self._flush_tasks:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+            self._flush_tasks = []
+            await self._flush_translation_cache()
+            # رویدادهای کیف‌پول سند حسابرسی‌اند → چند تلاش کوتاه پیش از بستن اتصال
+            for _ in range(self.EVENT_MAX_RETRIES):
+                if await self._flush_wallet_events(force=True):
+                    break
+                await asyncio.sleep(0.5)
+
+            # close در AsyncMongoClient کوروتین است
+            await self.client.close()
             self.logger.info("✅ Database connection closed.")        
             
     
\ No newline at end of file
@@ -7,34 +7,60 @@ import os
 import logging
 import asyncio
 import httpx
-import re
+import random
+import time
 
-from datetime import datetime
-from typing import List, Tuple
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
+from pymongo import ReturnDocument
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from bot_ui.language_Manager import TranslationManager
 from bot_ui.keyboards import TranslatedKeyboards
 from error_handler import ErrorHandler
-from state_manager import push_state
+from state_manager import push_state, PayState
 from myproject_database import Database
+from cache import TTLCache, MISS
 from Referral_logic_code import ReferralManager
 from core.blockchain_client import BlockchainClient
 
-from datetime import datetime
 from decimal import Decimal
 import config
 
-TXID_REGEX = re.compile(r"^[0-9A-Fa-f]{64}$")   # 64-char hex
+
+def _is_hex64(s: str) -> bool:
+    """TxID معتبر: دقیقاً 64 کاراکتر هگز (bytes.fromhex حلقهٔ C است، بدون regex)."""
+    if len(s) != 64:
+        return False
+    try:
+        # fromhex فاصله بین جفت‌ها را می‌پذیرد → طول خروجی هم چک شود
+        return len(bytes.fromhex(s)) == 32
+    except ValueError:
+        return False
+
+
 JOIN_FEE_USD        = Decimal("50")
 # ───── ثابت‌های تنظیمی ───────────────────────────────────────────────
 JOIN_FEE_USDT   = 50
 TOKEN_SYMBOL    = "USDT"
 DECIMALS        = 6                             # USDT on TRON = 6 decimals
-POLL_INTERVAL   = 30                            # ثانیه
-MAX_ATTEMPTS    = 15                            # ≈ 7.5 دقیقه
+CONFIRM_TIMEOUT    = 450                        # ≈ 7.5 دقیقه مهلت کل تأیید
+MONITOR_TICK       = 3                          # فاصلهٔ پایهٔ خواندن فید واریزها
+MAX_FEED_DELAY     = 45                         # سقف backoff فید (خطا / HTTP 429)
+FEED_LOOKBACK_MS   = 24 * 3600 * 1000           # واریزهای تا ۲۴ ساعت قبل از ثبت TxID
+FEED_PAGE_SIZE     = 200                        # سقف TronGrid برای هر صفحه
+# هر تیک معمولاً یک درخواست است؛ صفحه‌های بعدی (fingerprint) فقط وقتی خوانده می‌شوند
+# که بیش از FEED_PAGE_SIZE واریز از قدیمی‌ترین TxID در انتظار رسیده و هنوز TxIDی پیدا
+# نشده است – بدون آن، پرداخت قدیمی زیر واریزهای جدیدتر گم می‌شد. سقف: ۵ درخواست در تیک.
+FEED_MAX_PAGES     = 5
+MAX_PARALLEL_VERIFY = 10                        # سقف verify_txid هم‌زمان (خرید توکن)
+TXID_FILTER_WINDOW = 65_536                     # تعداد TxIDهای اخیر در مجموعهٔ درون‌حافظه
+PROFILE_CACHE_TTL = 30                          # ثانیه؛ پروفایل صفحهٔ پرداخت
+COMMISSION_RETRIES = 3                          # تلاش‌های درون‌فرایندی تقسیم کمیسیون
 
 # WALLET_JOIN_POOL: Address where membership fees are collected
 WALLET_JOIN_POOL = config.WALLET_JOIN_POOL
@@ -42,9 +68,118 @@ WALLET_JOIN_POOL = config.WALLET_JOIN_POOL
 
 TRADE_CHANNEL_ID = config.TRADE_CHANNEL_ID
 
+# ───── متن‌های ثابت (کلید ثابت → ترجمه یک‌بار و کش؛ در startup گرم می‌شوند) ─────
+_TEMPLATES: Dict[str, str] = {
+    "ask_txid": (
+        "🔔 Please send your transaction TxID (hash) now.\n\n"
+        "⚠️ The TxID is a mix of letters and numbers — please copy it exactly\n\n"
+        "to ensure your payment is confirmed promptly.\n\n"
+        "🔙 Use Back to return or Exit to cancel."
+    ),
+    "ask_txid_error": (
+        "🚫 Sorry, something went wrong while requesting your TxID.\n"
+        "Please try again or contact support."
+    ),
+    "invalid_txid": (
+        "🚫 <b>Invalid TxID format.</b>\n"
+        "Please send a valid 64-character hash containing only letters and numbers."
+    ),
+    "db_error": (
+        "🚫 <b>Internal error while storing your TxID.</b>\n"
+        "Please try again later."
+    ),
+    "duplicate_txid": (
+        "❌ <b>This TxID has already been submitted.</b>\n"
+        "If you think this is an error, please contact support."
+    ),
+    "txid_received": (
+        "✅ <b>TxID received!</b>\n"
+        "We’ll notify you once your transaction is confirmed on the blockchain."
+    ),
+    "txid_error": (
+        "⚠️ <b>An unexpected error occurred while processing your TxID.</b>\n"
+        "Please try again later or contact support."
+    ),
+    "criteria_mismatch": (
+        "❌ TxID is valid but does not match the required criteria "
+        "(destination, amount, or your wallet). Please verify and try again."
+    ),
+    "not_confirmed": (
+        "❌ <b>Payment was not confirmed within the expected time.</b>\n"
+        "If you already paid, please contact support with your TxID."
+    ),
+    # ── خرید توکن (prompt_trade_txid) ──
+    "trade_invalid_txid": "❌ <b>Invalid TxID format.</b>\nPlease send a valid 64-character hash.",
+    "trade_order_missing": "❌ <b>Order not found or expired.</b>\nPlease start a new trade.",
+    "trade_not_confirmed": (
+        "⏳ <b>Payment not confirmed yet.</b>\n"
+        "We’ll notify you as soon as it is confirmed on the blockchain."
+    ),
+    "trade_timeout": (
+        "❌ <b>Payment was not confirmed within the expected time.</b>\n"
+        "If you already paid, please contact support with your TxID."
+    ),
+    "trade_tokens_sold": "🎉 <b>Your tokens were sold!</b> ✅",
+    "trade_confirmed": "✅ <b>Payment confirmed.</b>\nTokens have been credited to your balance.",
+    "trade_error": (
+        "🚫 <b>An error occurred while processing your transaction.</b>\n"
+        "Please try again or contact support."
+    ),
+    "trade_settle_failed": (
+        "🚫 <b>Token transfer for this trade failed.</b>\n"
+        "The order was not completed – please contact support with your order ID."
+    ),
+}
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass(slots=True)
+class TxCheck:
+    """فیلدهای لازم از یک رویداد TRC20 فید TronGrid (یک بار استخراج، بدون زنجیرهٔ .get)."""
+    txid: str
+    is_transfer: bool
+    to_addr: str                   # lowercase
+    from_addr: str                 # lowercase
+    symbol: Optional[str]
+    amount: Decimal
+
+    @classmethod
+    def from_event(cls, ev: dict) -> "TxCheck":
+        token_info = ev.get("token_info") or {}
+        return cls(
+            txid=ev.get("transaction_id", "").lower(),
+            is_transfer=ev.get("type") == "Transfer",
+            to_addr=(ev.get("to") or "").lower(),
+            from_addr=(ev.get("from") or "").lower(),
+            symbol=token_info.get("symbol"),
+            amount=Decimal(ev.get("value") or "0") / 10 ** int(token_info.get("decimals", DECIMALS)),
+        )
+
+
+@dataclass
+class PendingTrade:
+    """TxID خرید توکن که تأییدش هنوز روی بلاک‌چین دیده نشده است."""
+    order: Dict[str, Any]
+    txid: str
+    buyer_id: int
+    bot: Any
+    deadline: float                # loop.time()
+
+
+@dataclass
+class PendingTx:
+    """یک TxID حق عضویت که منتظر دیده‌شدن در فید واریزهاست."""
+    chat_id: int
+    txid: str
+    bot: Any
+    inviter_id: Optional[int]
+    first_name: Optional[str]      # از update هنگام ثبت TxID (بدون get_chat در تأیید)
+    submitted_ms: int = 0          # زمان دیواری ثبت (ms) برای min_timestamp فید
+    check: Optional[TxCheck] = None                              # پر شده توسط حلقهٔ فید
+    seen: asyncio.Event = field(default_factory=asyncio.Event)   # set ← حلقهٔ فید
+
+
 class PaymentHandler:
     """
     هندلر «💳 Payment»
@@ -70,7 +205,207 @@ class PaymentHandler:
         self.blockchain = blockchain
         
         self.wallet_address = WALLET_JOIN_POOL or "TXXYYZZ_PLACEHOLDER_ADDRESS"
+        self._wallet_lower = self.wallet_address.lower()     # برای مقایسهٔ مقصد تراکنش
         self.logger = logging.getLogger(self.__class__.__name__)
+
+        # قالب دستورالعمل پرداخت: شکل و آدرس کیف‌پول ثابت‌اند → یک بار ساخته می‌شود
+        wallet = self.wallet_address.replace("{", "{{").replace("}", "}}")
+        tail = (
+            "1️⃣ Send $50 USDT (TRC-20) to:\n\n\n"
+            f"<code>{wallet}</code>\n\n\n"
+            "2️⃣ After sending, press the button below and select <b>TxID</b>."
+        )
+        self._tpl_profile = (
+            "💳 <b>Payment Instructions</b>\n\n"
+            "• Member No: <b>{member_no}</b>\n"
+            "• Referral Code: <code>{referral_code}</code>\n"
+            "• Current Balance: <b>${commission_usd:.2f}</b>\n\n"
+            + tail
+        )
+        self._tpl_no_profile = (
+            "💳 <b>Payment Instructions</b>\n\n"
+            "• Member No: —\n"
+            "• Referral Code: —\n"
+            "• Current Balance: —\n\n"
+            + tail
+        ).format()
+        # کلیدهای قابل ترجمه: متن‌های ثابت ماژول + دو قالب صفحهٔ پرداخت (با آدرس کیف‌پول)
+        self._templates: Dict[str, str] = {
+            **_TEMPLATES,
+            "pay_profile": self._tpl_profile,
+            "pay_no_profile": self._tpl_no_profile,
+        }
+        # پیام‌های ثابت رندرشده برای هر زبان: (template, lang) → متن ترجمه‌شده
+        self._text_cache: Dict[Tuple[str, str], str] = {}
+        # پروفایل برای صفحهٔ پرداخت (chat_id → profile)؛ با تأیید پرداخت invalidate می‌شود
+        self._profile_cache = TTLCache(maxsize=10_000, ttl=PROFILE_CACHE_TTL)
+
+        self._pay_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("TxID (transaction hash)", callback_data=PayState.PROMPT_TXID.value)],
+            [InlineKeyboardButton("⬅️ Back", callback_data="main_menu"),
+             InlineKeyboardButton("Exit",   callback_data="exit")]
+        ])
+
+        # یک کلاینت HTTP مشترک برای همهٔ پایش‌ها (keep-alive + HTTP/2 multiplexing)
+        self._http = httpx.AsyncClient(
+            timeout=10,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=10),
+        )
+
+        # مجموعهٔ دقیق TxIDهای اخیر: عضویت O(1) به‌جای رفت‌وبرگشت DB
+        # (deque موازی ترتیب ورود را نگه می‌دارد تا قدیمی‌ترین‌ها حذف شوند)
+        self._seen_txids: set[str] = set()
+        self._recent_txids: deque[str] = deque()
+
+        # TxIDهای در انتظار + یک تسک پایش مشترک (به‌جای یک حلقه برای هر کاربر)
+        self._pending: Dict[str, PendingTx] = {}
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._feed_delay: float = MONITOR_TICK           # با خطا/429 بزرگ می‌شود
+        # همهٔ تسک‌های پس‌زمینه اینجا نگه داشته می‌شوند (نه fire-and-forget)
+        self._tasks: set[asyncio.Task] = set()
+
+        # سقف درخواست‌های هم‌زمان تأیید TxID معاملات به API بلاک‌چین
+        self._verify_sem = asyncio.Semaphore(MAX_PARALLEL_VERIFY)
+        # معاملات منتظر تأیید + یک حلقهٔ مشترک (کاربر دیگر لازم نیست دوباره TxID بفرستد)
+        self._trades: Dict[str, PendingTrade] = {}
+        self._trade_task: Optional[asyncio.Task] = None
+        self._trade_delay: float = MONITOR_TICK          # backoff مستقل حلقهٔ معاملات
+
+        # صف تقسیم کمیسیون (پیام موفقیت منتظر پیمایش upline نمی‌ماند)
+        self._commission_q: asyncio.Queue[Tuple[Dict[str, Any], str]] = asyncio.Queue()
+        self._commission_task: Optional[asyncio.Task] = None
+        self._feed_url = f"https://api.trongrid.io/v1/accounts/{self.wallet_address}/transactions/trc20"
+        self._feed_headers = (
+            {"TRON-PRO-API-KEY": config.TRON_PRO_API_KEY} if config.TRON_PRO_API_KEY else {}
+        )
+
+    #-----------------------------------------------------------------------------------------
+    async def warmup(self) -> None:
+        """
+        یک بار در startup: پر کردن مجموعهٔ TxID از آخرین پرداخت‌های ثبت‌شده
+        و گرم کردن کش ترجمهٔ متن‌های ثابت.
+        """
+        try:
+            for txid in reversed(await self.db.recent_txids(TXID_FILTER_WINDOW)):
+                self._remember_txid(txid)
+            self.logger.info(f"TxID set warmed with {len(self._seen_txids)} entries")
+        except Exception as e:
+            self.logger.warning(f"TxID set warmup failed: {e}")
+
+        # ترجمهٔ متن‌های ثابت در پس‌زمینه (startup منتظر LLM نمی‌ماند)
+        self._spawn(self.translation_manager.prewarm(self._templates.values()), "prewarm")
+
+    def _remember_txid(self, txid: str) -> None:
+        if txid in self._seen_txids:
+            return
+        self._seen_txids.add(txid)
+        self._recent_txids.append(txid)
+        if len(self._recent_txids) > TXID_FILTER_WINDOW:
+            self._seen_txids.discard(self._recent_txids.popleft())
+
+    #-----------------------------------------------------------------------------------------
+    def _spawn(self, coro, name: str) -> asyncio.Task:
+        """ساخت تسک پس‌زمینهٔ تحت نظارت: ارجاع نگه داشته می‌شود و خطا گم نمی‌شود."""
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(
+                f"Background task {task.get_name()} crashed: {task.exception()}",
+                exc_info=task.exception(),
+            )
+
+    #-----------------------------------------------------------------------------------------
+    async def _t(self, key: str, chat_id: int, lang: Optional[str] = None) -> str:
+        """
+        متن ترجمه‌شدهٔ self._templates[key] به زبان کاربر؛
+        هر (template, lang) فقط یک بار ترجمه می‌شود و بعد یک lookup دیکشنری است.
+        """
+        lang = lang or await self.db.get_user_language(chat_id)
+        text = self._text_cache.get((key, lang))
+        if text is not None:
+            return text
+
+        template = self._templates[key]
+        text = await self.translation_manager.get_translated_message(template, lang)
+        # متن انگلیسیِ برگشتی از خطای ترجمه کش نشود تا دفعهٔ بعد دوباره تلاش شود
+        if lang == "en" or text != template:
+            self._text_cache[(key, lang)] = text
+        return text
+
+    async def _render(self, key: str, chat_id: int) -> Tuple[str, Any]:
+        """
+        متن _t(key) به‌همراه کیبورد Back/Exit به زبان کاربر (کیبورد در TranslatedKeyboards کش می‌شود).
+        متن و کیبورد مستقل‌اند → هم‌زمان؛ روی cache miss تأخیر max(ترجمه، کیبورد) است نه جمعشان.
+        """
+        text, markup = await asyncio.gather(
+            self._t(key, chat_id),
+            self.keyboards.build_back_exit_keyboard(chat_id),
+        )
+        return text, markup
+
+    async def _reply(self, message, key: str, chat_id: int):
+        """پاسخ به پیام کاربر با متن key و کیبورد Back/Exit."""
+        text, markup = await self._render(key, chat_id)
+        return await message.reply_text(text, parse_mode="HTML", reply_markup=markup)
+
+    async def _notify(self, bot, key: str, chat_id: int):
+        """ارسال پیام key با کیبورد Back/Exit (برای مسیرهای پس‌زمینه که update ندارند)."""
+        text, markup = await self._render(key, chat_id)
+        return await bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=markup)
+
+    #-----------------------------------------------------------------------------------------
+    def _enqueue_commission(self, profile: Dict[str, Any], txid: str) -> None:
+        self._commission_q.put_nowait((profile, txid))
+        if self._commission_task is None or self._commission_task.done():
+            self._commission_task = self._spawn(self._commission_worker(), "commission_worker")
+
+    async def _commission_worker(self) -> None:
+        """
+        کارگر صف کمیسیون: هر پرداخت تأییدشده را به ReferralManager می‌دهد.
+        تقسیم per-TxID و مرحله‌به‌مرحله ثبت می‌شود → تلاش دوباره فقط مراحل باقی‌مانده را
+        انجام می‌دهد؛ بعد از COMMISSION_RETRIES تلاش، sweep بعدی startup ادامه می‌دهد.
+        """
+        while True:
+            profile, txid = await self._commission_q.get()
+            try:
+                for attempt in range(1, COMMISSION_RETRIES + 1):
+                    try:
+                        await self.referral_manager._distribute_commission(profile, txid)
+                        break
+                    except Exception as e:
+                        self.logger.error(
+                            f"[commission] distribution of {txid} for {profile.get('user_id')} "
+                            f"failed (attempt {attempt}/{COMMISSION_RETRIES}): {e}",
+                            exc_info=True,
+                        )
+                        if attempt < COMMISSION_RETRIES:
+                            await asyncio.sleep(2 ** attempt)
+            finally:
+                self._commission_q.task_done()
+
+    #-----------------------------------------------------------------------------------------
+    async def aclose(self) -> None:
+        """توقف تسک‌های پس‌زمینه و بستن کلاینت HTTP مشترک هنگام shutdown."""
+        # کمیسیون‌های در صف نباید با shutdown گم شوند
+        if self._commission_task and not self._commission_task.done():
+            try:
+                await asyncio.wait_for(self._commission_q.join(), timeout=30)
+            except asyncio.TimeoutError:
+                self.logger.error(
+                    f"Shutdown with {self._commission_q.qsize()} commissions not distributed"
+                )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pending:
+            self.logger.warning(f"Shutdown with {len(self._pending)} payments still pending")
+        await self._http.aclose()
         
     #-----------------------------------------------------------------------------------------
     async def show_payment_instructions(
@@ -80,42 +415,49 @@ class PaymentHandler:
         first_name = update.effective_user.first_name
 
         try:
-            # اطمینان از وجود رکورد کاربر
-            await self.db.insert_user_if_not_exists(chat_id, first_name)
-
-            profile = await self.db.get_profile(chat_id)
+            # پروفایل و زبان مستقل‌اند → هم‌زمان
+            cached = self._profile_cache.get(chat_id)
+            if cached is MISS:
+                profile, lang = await asyncio.gather(
+                    self.db.get_profile(chat_id),
+                    self.db.get_user_language(chat_id),
+                )
+                if profile is None:
+                    # کاربر تازه: ساخت رکورد (upsert) باید قبل از خواندن پروفایل باشد؛
+                    # get_profile روی primary است پس سند تازه را می‌بیند
+                    await self.db.insert_user_if_not_exists(chat_id, first_name)
+                    profile = await self.db.get_profile(chat_id)
+                # نبودِ پروفایل کش نمی‌شود تا یک خطای گذرا 30 ثانیه ماندگار نشود
+                if profile is not None:
+                    self._profile_cache.set(chat_id, profile)
+            else:
+                profile, lang = cached, await self.db.get_user_language(chat_id)
 
-            lines = ["💳 <b>Payment Instructions</b>\n"]
+            # قالب یک بار برای هر زبان ترجمه می‌شود؛ فقط فیلدهای پویا جایگذاری می‌شوند
+            lang = lang or "en"
             if profile:
-                lines += [
-                    f"• Member No: <b>{profile['member_no']}</b>",
-                    f"• Referral Code: <code>{profile['referral_code']}</code>",
-                    f"• Current Balance: <b>${profile['commission_usd']:.2f}</b>\n"
-                ]
+                fields = {
+                    "member_no": profile["member_no"],
+                    "referral_code": profile["referral_code"],
+                    "commission_usd": profile["commission_usd"],
+                }
+                tpl = await self._t("pay_profile", chat_id, lang)
+                try:
+                    text = tpl.format(**fields)
+                except (KeyError, IndexError, ValueError):
+                    # ترجمه placeholderها را به‌هم ریخته → ترجمهٔ مستقیم پیام نهایی
+                    text = await self.translation_manager.get_translated_message(
+                        self._tpl_profile.format(**fields), lang
+                    )
             else:
-                lines += [
-                    "• Member No: —",
-                    "• Referral Code: —",
-                    "• Current Balance: —\n"
-                ]
-
-            lines += [
-                "1️⃣ Send $50 USDT (TRC-20) to:\n\n",
-                f"<code>{self.wallet_address}</code>\n\n",
-                "2️⃣ After sending, press the button below and select <b>TxID</b>."
-            ]
-            msg = "\n".join(lines)
+                text = await self._t("pay_no_profile", chat_id, lang)
 
             # تنظیم state برای دریافت TxID
-            push_state(context, "prompt_txid")
+            push_state(context, PayState.PROMPT_TXID)
             await update.message.reply_text(
-                await self.translation_manager.translate_for_user(msg, chat_id),
+                text,
                 parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("TxID (transaction hash)", callback_data="prompt_txid")],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="main_menu"),
-                     InlineKeyboardButton("Exit",   callback_data="exit")]
-                ])
+                reply_markup=self._pay_markup,
             )
         except Exception as e:
             await self.eh.handle(update, context, e)    
@@ -131,39 +473,15 @@ class PaymentHandler:
 
         try:
             # ➊ Set state to wait for transaction hash
-            push_state(context, "awaiting_sub_txid")
-            context.user_data["state"] = "awaiting_sub_txid"
+            push_state(context, PayState.AWAITING_TXID)
 
             # ➋ Build prompt message
-            prompt_text = (
-                "🔔 Please send your transaction TxID (hash) now.\n\n"
-                "⚠️ The TxID is a mix of letters and numbers — please copy it exactly\n\n"
-                "to ensure your payment is confirmed promptly.\n\n"
-                "🔙 Use Back to return or Exit to cancel."
-            )
-
-            translated = await self.translation_manager.translate_for_user(prompt_text, chat_id)
-
-            await update.message.reply_text(
-                translated,
-                parse_mode="HTML",
-                reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id)
-            )
+            await self._reply(update.message, "ask_txid", chat_id)
 
         except Exception as e:
             self.logger.error(f"Error in prompt_for_txid: {e}", exc_info=True)
 
-            error_text = (
-                "🚫 Sorry, something went wrong while requesting your TxID.\n"
-                "Please try again or contact support."
-            )
-            translated_error = await self.translation_manager.translate_for_user(error_text, chat_id)
-
-            await update.message.reply_text(
-                translated_error,
-                parse_mode="HTML",
-                reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id)
-            )
+            await self._reply(update.message, "ask_txid_error", chat_id)
             
     #-------------------------------------------------------------------------------------   
     def is_valid_txid(self, txid: str) -> bool:
@@ -171,7 +489,7 @@ class PaymentHandler:
         اعتبارسنجی TxID:
         - فرض: 64 کاراکتر هگز [0-9A-Fa-f]
         """
-        return bool(re.fullmatch(r"[0-9A-Fa-f]{64}", txid))
+        return _is_hex64(txid)
     
     #-------------------------------------------------------------------------------------  
     async def handle_txid(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -184,204 +502,344 @@ class PaymentHandler:
 
         try:
             # ── ۱) ولیدیشن فرمت ───────────────────────────────
-            if not TXID_REGEX.fullmatch(txid):
-                invalid_msg = (
-                    "🚫 <b>Invalid TxID format.</b>\n"
-                    "Please send a valid 64-character hash containing only letters and numbers."
-                )
-                translated = await self.translation_manager.translate_for_user(invalid_msg, chat_id)
-                return await update.message.reply_text(
-                    translated,
-                    parse_mode="HTML",
-                    reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id)
-                )
-
-            # ── ۲) چک تکراری‌بودن ─────────────────────────────
-            if await self.db.is_txid_used(txid):
-                duplicate_msg = (
-                    "❌ <b>This TxID has already been submitted.</b>\n"
-                    "If you think this is an error, please contact support."
-                )
-                translated = await self.translation_manager.translate_for_user(duplicate_msg, chat_id)
-                return await update.message.reply_text(
-                    translated,
-                    parse_mode="HTML",
-                    reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id)
-                )
+            if not _is_hex64(txid):
+                return await self._reply(update.message, "invalid_txid", chat_id)
+            # یک شکل canonical (مثل transaction_id فید) تا همان هش با حروف بزرگ/کوچک
+            # دو رکورد و دو پایش جدا نسازد
+            txid = txid.lower()
+
+            # ── ۲+۳) چک تکراری‌بودن و درج در DB ──────────────
+            # مجموعهٔ درون‌حافظه دقیق است → بدون کوئری DB؛ TxIDهای قدیمی‌تر از
+            # پنجره را ایندکس unique_txid هنگام درج می‌گیرد.
+            duplicate = txid in self._seen_txids
+            if not duplicate:
+                try:
+                    duplicate = not await self.db.try_store_payment_txid(
+                        chat_id, txid,
+                        inviter_id=context.user_data.get("inviter_id"),
+                        first_name=update.effective_user.first_name,
+                    )
+                except Exception as e:
+                    self.logger.error(f"[handle_txid] DB error: {e}", exc_info=True)
+                    return await self._reply(update.message, "db_error", chat_id)
 
-            # ── ۳) درج در DB ─────────────────────────────────
-            try:
-                await self.db.store_payment_txid(chat_id, txid)
-            except Exception as e:
-                self.logger.error(f"[handle_txid] DB error: {e}", exc_info=True)
-                db_error_msg = (
-                    "🚫 <b>Internal error while storing your TxID.</b>\n"
-                    "Please try again later."
-                )
-                translated = await self.translation_manager.translate_for_user(db_error_msg, chat_id)
-                return await update.message.reply_text(
-                    translated,
-                    parse_mode="HTML",
-                    reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id)
-                )
+            self._remember_txid(txid)
+            if duplicate:
+                return await self._reply(update.message, "duplicate_txid", chat_id)
 
             # ── ۴) ذخیره state ────────────────────────────────
-            push_state(context, "sub_txid_received")
-            context.user_data["state"] = "sub_txid_received"
+            push_state(context, PayState.TXID_RECEIVED)
 
             # ── ۵) پیام تأیید به کاربر ───────────────────────
-            confirm_msg = (
-                "✅ <b>TxID received!</b>\n"
-                "We’ll notify you once your transaction is confirmed on the blockchain."
-            )
-            translated = await self.translation_manager.translate_for_user(confirm_msg, chat_id)
-            await update.message.reply_text(
-                translated,
-                parse_mode="HTML",
-                reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id)
-            )
+            await self._reply(update.message, "txid_received", chat_id)
 
             # ── ۶) آغاز پایش بلاک‌چین ─────────────────────────
-            context.application.create_task(
-                self.monitor_payment(chat_id=chat_id, txid=txid, bot=context.bot)
+            self.track_payment(
+                chat_id=chat_id,
+                txid=txid,
+                bot=context.bot,
+                inviter_id=context.user_data.get("inviter_id"),
+                first_name=update.effective_user.first_name,
             )
 
         except Exception as e:
             self.logger.error(f"Unexpected error in handle_txid: {e}", exc_info=True)
-            error_msg = (
-                "⚠️ <b>An unexpected error occurred while processing your TxID.</b>\n"
-                "Please try again later or contact support."
-            )
-            translated = await self.translation_manager.translate_for_user(error_msg, chat_id)
-            await update.message.reply_text(
-                translated,
-                parse_mode="HTML",
-                reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id)
-            )
+            await self._reply(update.message, "txid_error", chat_id)
 
     # ─────────────────────────────────────────────────────────────
     # ➋ پایش تراکنش روی بلاک‌چین و تخصیص توکن
     # ─────────────────────────────────────────────────────────────
-    async def monitor_payment(
+    def track_payment(
         self,
         chat_id: int,
         txid: str,
         bot,
-        context: ContextTypes.DEFAULT_TYPE,
+        inviter_id: Optional[int] = None,
+        first_name: Optional[str] = None,
+        submitted_ms: Optional[int] = None,
     ) -> None:
         """
-        هر ۳۰ ثانیه وضعیت تراکنش TRC-20 را چک می‌کند تا تأیید شود.
-        پس از تأیید:
-          1) ثبت وضعیت پرداخت
-          2) فراخوانی ReferralManager برای تقسیم کمیسیون و تخصیص airdrop
-          3) ایجاد/به‌روزرسانی پروفایل کاربر
-          4) ارسال پیام موفقیت
-        در غیر این صورت پس از ۱۵ تلاش → وضعیت failed
+        TxID را به صف پایش مشترک اضافه می‌کند، یک منتظرِ سبک برایش می‌سازد و در صورت نیاز
+        حلقهٔ فید را راه می‌اندازد.
+        inviter_id و first_name همین‌جا از user_data/update گرفته می‌شوند چون حلقه به
+        context دسترسی ندارد (و نیازی به فراخوانی get_chat در مسیر تأیید نباشد).
         """
-        # بارگذاری کیف‌پول join-pool به صورت lowercase برای مقایسه
-        join_pool_address = self.wallet_address.lower()
-
-        tron_api = f"https://api.trongrid.io/wallet/gettransactionbyid?value={txid}"
+        # کلید lowercase تا با transaction_id فید TronGrid یکی باشد
+        key = txid.lower()
+        if key in self._pending:
+            return      # همین TxID قبلاً در صف پایش است (resume + ارسال دوباره)
+
+        pending = PendingTx(
+            chat_id=chat_id, txid=txid, bot=bot, inviter_id=inviter_id,
+            first_name=first_name,
+            submitted_ms=submitted_ms if submitted_ms is not None else int(time.time() * 1000),
+        )
+        self._pending[key] = pending
+        self._spawn(self._await_confirmation(pending), f"await_tx_{txid[:8]}")
+        if self._monitor_task is None or self._monitor_task.done():
+            self._monitor_task = self._spawn(self._monitor_loop(), "monitor_payment")
 
-        for attempt in range(1, MAX_ATTEMPTS + 1):
-            try:
-                async with httpx.AsyncClient(timeout=10) as client:
-                    data = (await client.get(tron_api)).json()
+    #-------------------------------------------------------------------------------------   
+    async def resume_pending(self, bot) -> None:
+        """
+        پس از restart: پرداخت‌های pending ذخیره‌شده در DB دوباره به پایش برمی‌گردند
+        (هر کدام با مهلت کامل CONFIRM_TIMEOUT از همین لحظه) و پرداخت‌های confirming
+        دوباره نهایی می‌شوند.
+        """
+        since = datetime.now(timezone.utc) - timedelta(milliseconds=FEED_LOOKBACK_MS)
+        resumed = 0
+        try:
+            async for doc in self.db.iter_pending_payments(since.replace(tzinfo=None)):
+                txid = doc.get("txid")
+                if not txid or txid.lower() in self._pending:
+                    continue
+                submitted = doc["timestamp"].replace(tzinfo=timezone.utc)
+                self.track_payment(
+                    chat_id=doc["user_id"],
+                    txid=txid,
+                    bot=bot,
+                    inviter_id=doc.get("inviter_id"),
+                    first_name=doc.get("first_name"),
+                    submitted_ms=int(submitted.timestamp() * 1000),
+                )
+                resumed += 1
+        except Exception as e:
+            self.logger.error(f"[monitor_payment] resume failed: {e}", exc_info=True)
+        if resumed:
+            self.logger.info(f"[monitor_payment] resumed {resumed} pending payments")
 
-                # بررسی موفقیت قرارداد و امضا
-                status_ok = (
-                    data.get("ret")
-                    and data["ret"][0].get("contractRet") == "SUCCESS"
+        # ادعاشده ولی نهایی‌نشده (crash یا خطای ensure_user بین confirming و confirmed):
+        # واریز قبلاً روی زنجیره تأیید شده → مستقیم نهایی‌سازی، بدون انتظار برای فید
+        finalized = 0
+        try:
+            async for doc in self.db.iter_pending_payments(status="confirming"):
+                if not doc.get("txid"):
+                    continue
+                pending = PendingTx(
+                    chat_id=doc["user_id"], txid=doc["txid"], bot=bot,
+                    inviter_id=doc.get("inviter_id"), first_name=doc.get("first_name"),
                 )
+                self._spawn(self._finalize_payment(pending), f"finalize_tx_{doc['txid'][:8]}")
+                finalized += 1
+        except Exception as e:
+            self.logger.error(f"[monitor_payment] resume (confirming) failed: {e}", exc_info=True)
+        if finalized:
+            self.logger.info(f"[monitor_payment] re-finalizing {finalized} claimed payments")
 
-                prm = data["raw_data"]["contract"][0]["parameter"]["value"]
-                to_addr = prm.get("to_address", "").lower()
-                owner_addr = prm.get("owner_address", "").lower()
-
-                # بررسی مقصد و فرستنده
-                to_ok = to_addr == join_pool_address
-                user_wallet = await self.db.get_wallet_address(chat_id)
-                owner_ok = True if not user_wallet else owner_addr == user_wallet.lower()
-
-                # بررسی توکن و مقدار
-                token_ok = data.get("tokenInfo", {}).get("symbol") == TOKEN_SYMBOL
-                amount = int(data.get("amount_str", "0")) / 10**DECIMALS
-                amount_ok = amount >= JOIN_FEE_USD
-
-                if status_ok and to_ok and owner_ok and token_ok and amount_ok:
-                    # 1) ذخیره وضعیت پرداخت
-                    await self.db.update_payment_status(txid, "confirmed")
-
-                    # 2) تقسیم کمیسیون و تخصیص airdrop
-                    # ابتدا پروفایل کاربر را بساز/بروزرسانی کن
-                    profile = await self.referral_manager.ensure_user(
-                        user_id=chat_id,
-                        first_name=bot.get_chat(chat_id).first_name,
-                        inviter_id=context.user_data.get("inviter_id")
-                    )
-                    # سپس گردش 50$ join-fee را در ReferralManager انجام بده
-                    await self.referral_manager._distribute_commission(profile)
-
-                    # 3) ارسال پیام موفقیت
-                    success_msg = (
-                        "✅ پرداخت با موفقیت ثبت شد!\n\n"
-                        f"• Member No: <b>{profile['member_no']}</b>\n"
-                        f"• Referral Code: <code>{profile['referral_code']}</code>\n"
-                        f"• Tokens Allocated: <b>{profile['tokens']:.0f}</b>"
-                    )
-                    translated = await self.translation_manager.translate_for_user(
-                        success_msg, chat_id
-                    )
-                    await bot.send_message(
-                        chat_id,
-                        translated,
-                        parse_mode="HTML",
-                        reply_markup=await self.keyboards.build_main_menu_keyboard_v2(
-                            chat_id
-                        ),
-                    )
-                    self.logger.info(f"[monitor_payment] ✅ confirmed for {chat_id}")
+        # تأییدشده ولی تقسیم کمیسیون ناتمام (خطا یا restart وسط تقسیم) → ادامه از مرحلهٔ بعدی
+        # (confirmingها را _finalize_payment خودش دوباره در صف می‌گذارد)
+        requeued = 0
+        try:
+            async for doc in self.db.iter_unsplit_payments():
+                if doc.get("status") == "confirming" or not doc.get("txid"):
+                    continue
+                user_doc = await self.db.collection_users.find_one({"user_id": doc["user_id"]})
+                if user_doc is None:
+                    continue
+                self._enqueue_commission(user_doc, doc["txid"])
+                requeued += 1
+        except Exception as e:
+            self.logger.error(f"[commission] resume failed: {e}", exc_info=True)
+        if requeued:
+            self.logger.info(f"[commission] resumed {requeued} unfinished commission splits")
+
+    #-------------------------------------------------------------------------------------   
+    async def _monitor_loop(self) -> None:
+        """
+        یک حلقهٔ واحد برای همهٔ TxIDهای در انتظار، مبتنی بر فید واریزها:
+          • هر MONITOR_TICK ثانیه فقط فید واریزهای USDT به WALLET_JOIN_POOL خوانده می‌شود
+            (یک درخواست برای همه، نه یک درخواست برای هر TxID)
+          • برای رویدادهایی که txid آن‌ها در self._pending است، Event منتظرش set می‌شود
+        مهلت و نهایی‌سازی با _await_confirmation است؛ وقتی صف خالی شود حلقه تمام
+        می‌شود و با TxID بعدی دوباره ساخته می‌شود.
+        """
+        try:
+            await self._monitor_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.exception(f"[monitor_payment] loop crashed: {e}")
+            # TxIDهای باقی‌مانده بی‌صاحب نمانند → پس از یک تیک حلقه دوباره ساخته می‌شود
+            await asyncio.sleep(MONITOR_TICK)
+            if self._pending:
+                self._monitor_task = self._spawn(self._monitor_loop(), "monitor_payment")
+
+    async def _monitor_pending(self) -> None:
+        while self._pending:
+            since = min(p.submitted_ms for p in self._pending.values()) - FEED_LOOKBACK_MS
+            events = await self._fetch_join_transfers(since)
+
+            for txid, check in events.items():
+                p = self._pending.pop(txid, None)
+                if p is not None:
+                    p.check = check
+                    p.seen.set()
+            # jitter تا چند نمونهٔ بات هم‌گام به TronGrid نزنند
+            await asyncio.sleep(self._feed_delay * random.uniform(0.7, 1.3))
+
+    #-------------------------------------------------------------------------------------   
+    async def _await_confirmation(self, pending: PendingTx) -> None:
+        """
+        منتظر یک TxID: تا CONFIRM_TIMEOUT ثانیه روی Event آن می‌خوابد (بدون polling)؛
+        دیده شد → _process_confirmation، نشد → failed.
+        """
+        try:
+            await asyncio.wait_for(pending.seen.wait(), timeout=CONFIRM_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._pending.pop(pending.txid.lower(), None)
+            await self._payment_failed(pending)
+            return
+        await self._process_confirmation(pending, pending.check)
+
+    #-------------------------------------------------------------------------------------   
+    async def _fetch_join_transfers(self, min_timestamp: int) -> Dict[str, TxCheck]:
+        """
+        واریزهای تأییدشدهٔ USDT-TRC20 به کیف‌پول join-pool از TronGrid
+        (جدیدترین اول، حداکثر FEED_MAX_PAGES صفحه) → {transaction_id: event}
+        """
+        params = {
+            "only_to": "true",
+            "only_confirmed": "true",
+            "contract_address": config.USDT_CONTRACT,
+            "min_timestamp": max(min_timestamp, 0),
+            "limit": FEED_PAGE_SIZE,
+        }
+        events: Dict[str, TxCheck] = {}
+        try:
+            for _ in range(FEED_MAX_PAGES):
+                resp = await self._http.get(self._feed_url, params=params, headers=self._feed_headers)
+                if resp.status_code == 429:
+                    # rate limit → فاصلهٔ بعدی ×4 (تا سقف)
+                    self._feed_delay = min(self._feed_delay * 4, MAX_FEED_DELAY)
+                    self.logger.warning(f"[monitor_payment] TronGrid 429 – next read in ~{self._feed_delay:.0f}s")
+                    return events
+                resp.raise_for_status()
+                body = resp.json()
+                for ev in body.get("data", []):
+                    try:
+                        check = TxCheck.from_event(ev)
+                    except (ValueError, ArithmeticError, TypeError) as e:
+                        self.logger.warning(f"[monitor_payment] malformed transfer event: {e}")
+                        continue
+                    events[check.txid] = check
+                fingerprint = body.get("meta", {}).get("fingerprint")
+                # اگر همهٔ TxIDهای در انتظار پیدا شدند صفحهٔ بعد لازم نیست
+                if not fingerprint or self._pending.keys() <= events.keys():
+                    break
+                params["fingerprint"] = fingerprint
+            self._feed_delay = MONITOR_TICK
+        except Exception as e:
+            self._feed_delay = min(self._feed_delay * 2, MAX_FEED_DELAY)
+            self.logger.warning(f"[monitor_payment] transfer feed error: {e}")
+        return events
+
+    #-------------------------------------------------------------------------------------   
+    async def _process_confirmation(self, pending: PendingTx, check: TxCheck) -> None:
+        """
+        پس از دیدن واریز در فید:
+          1) ادعای پرداخت (pending→confirming)
+          2–4) _finalize_payment: پروفایل و airdrop، صف کمیسیون، confirmed و پیام موفقیت
+        اگر قرارداد ناموفق بود یا معیارها برقرار نبود → failed
+        """
+        chat_id, txid, bot = pending.chat_id, pending.txid, pending.bot
+
+        try:
+            # فید فقط انتقال‌های تأییدشدهٔ Transfer را برمی‌گرداند
+            status_ok = check.is_transfer
+
+            # بررسی مقصد و فرستنده
+            to_ok = check.to_addr == self._wallet_lower
+            user_wallet = await self.db.get_wallet_address(chat_id)
+            owner_ok = True if not user_wallet else check.from_addr == user_wallet.lower()
+
+            # بررسی توکن و مقدار
+            token_ok = check.symbol == TOKEN_SYMBOL
+            amount_ok = check.amount >= JOIN_FEE_USD
+
+            if status_ok and to_ok and owner_ok and token_ok and amount_ok:
+                # 1) ادعای پرداخت – گذار شرطی pending→confirming تا کمیسیون حتی با دو
+                #    نمونهٔ پایش هم‌زمان فقط یک بار پخش شود؛ confirmed پس از اثرات جانبی
+                # split_done=False: نشانهٔ تقسیم کمیسیونِ معوق برای sweep پس از restart
+                if not await self.db.update_payment_status(
+                    txid, "confirming", expected="pending", extra={"split_done": False}
+                ):
+                    self.logger.info(f"[monitor_payment] {txid} already finalized – skipped")
                     return
+                await self._finalize_payment(pending)
+                return
 
-                # تراکنش موجود ولی معیارها برقرار نیست
-                if status_ok and (not to_ok or not token_ok or not amount_ok or not owner_ok):
-                    await self.db.update_payment_status(txid, "failed")
-                    warn_msg = (
-                        "❌ TxID is valid but does not match the required criteria "
-                        "(destination, amount, or your wallet). Please verify and try again."
-                    )
-                    translated_warn = await self.translation_manager.translate_for_user(
-                        warn_msg, chat_id
-                    )
-                    await bot.send_message(
-                        chat_id,
-                        translated_warn,
-                        parse_mode="HTML",
-                        reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id),
-                    )
+            # تراکنش موجود ولی معیارها برقرار نیست
+            if status_ok and (not to_ok or not token_ok or not amount_ok or not owner_ok):
+                if not await self.db.update_payment_status(txid, "failed", expected="pending"):
                     return
+                await self._notify(bot, "criteria_mismatch", chat_id)
+                return
 
-            except Exception as e:
-                self.logger.warning(f"[monitor_payment] attempt {attempt}: {e}")
+        except Exception as e:
+            self.logger.warning(f"[monitor_payment] {txid}: {e}")
 
-            await asyncio.sleep(POLL_INTERVAL)
+        await self._payment_failed(pending)
 
-        # پس از اتمام تلاش‌ها
-        await self.db.update_payment_status(txid, "failed")
-        error_msg = (
-            "❌ <b>Payment was not confirmed within the expected time.</b>\n"
-            "If you already paid, please contact support with your TxID."
-        )
-        translated_error = await self.translation_manager.translate_for_user(
-            error_msg, chat_id
-        )
-        await bot.send_message(
-            chat_id,
-            translated_error,
-            parse_mode="HTML",
-            reply_markup=await self.keyboards.build_back_exit_keyboard(chat_id),
-        )
-        self.logger.warning(f"[monitor_payment] FAILED after {MAX_ATTEMPTS} for {chat_id}")
+    #-------------------------------------------------------------------------------------   
+    async def _finalize_payment(self, pending: PendingTx) -> None:
+        """
+        پرداختِ ادعاشده (confirming): ساخت پروفایل، صف کمیسیون، سپس confirmed و پیام موفقیت.
+        اگر ensure_user خطا دهد سند در confirming می‌ماند و resume_pending پس از restart
+        دوباره همین‌جا را اجرا می‌کند (ensure_user و کمیسیون هر دو idempotent هستند).
+        """
+        chat_id, txid, bot = pending.chat_id, pending.txid, pending.bot
+
+        try:
+            # 2) ساخت/به‌روزرسانی پروفایل کاربر و تخصیص airdrop
+            profile = await self.referral_manager.ensure_user(
+                user_id=chat_id,
+                first_name=pending.first_name,
+                inviter_id=pending.inviter_id
+            )
+            # 3) گردش 50$ join-fee در ReferralManager → صف کارگر پس‌زمینه
+            #    (پیش از پیام: خطای ارسال تلگرام نباید کمیسیون را از دست بدهد)
+            self._enqueue_commission(profile, txid)
+            await self.db.update_payment_status(txid, "confirmed", expected="confirming")
+        except Exception as e:
+            self.logger.error(
+                f"[monitor_payment] finalizing {txid} failed (left in 'confirming'): {e}",
+                exc_info=True,
+            )
+            return
+        self._profile_cache.pop(chat_id)
+
+        # 4) ارسال پیام موفقیت – خطای آن (بلاک‌شدن ربات، timeout، ترجمه) فقط لاگ می‌شود
+        try:
+            success_msg = (
+                "✅ پرداخت با موفقیت ثبت شد!\n\n"
+                f"• Member No: <b>{profile['member_no']}</b>\n"
+                f"• Referral Code: <code>{profile['referral_code']}</code>\n"
+                f"• Tokens Allocated: <b>{profile['tokens']:.0f}</b>"
+            )
+            translated = await self.translation_manager.translate_for_user(
+                success_msg, chat_id
+            )
+            await bot.send_message(
+                chat_id,
+                translated,
+                parse_mode="HTML",
+                reply_markup=await self.keyboards.build_main_menu_keyboard_v2(
+                    chat_id
+                ),
+            )
+        except Exception as e:
+            self.logger.warning(f"[monitor_payment] success notice to {chat_id} failed: {e}")
+        self.logger.info(f"[monitor_payment] ✅ confirmed for {chat_id}")
+
+    #-------------------------------------------------------------------------------------   
+    async def _payment_failed(self, pending: PendingTx) -> None:
+        """پرداخت تأیید نشد (پایان مهلت یا اجرای ناموفق) → وضعیت failed و اطلاع به کاربر."""
+        chat_id, txid, bot = pending.chat_id, pending.txid, pending.bot
+
+        if not await self.db.update_payment_status(txid, "failed", expected="pending"):
+            return      # قبلاً نهایی شده (مثلاً confirmed) → پیام شکست ارسال نشود
+        await self._notify(bot, "not_confirmed", chat_id)
+        self.logger.warning(f"[monitor_payment] FAILED for {chat_id} (txid={txid})")
 
     # =========================================================================
     #  ب) دریافت و تأیید TxID خریدار
@@ -396,97 +854,244 @@ class PaymentHandler:
         buyer_id = update.effective_chat.id
         chat_id = buyer_id  # برای ارسال ترجمه
         txid = (update.message.text or "").strip()
+        order, verified = None, False
 
         try:
+            now = datetime.now(timezone.utc)   # یک زمان برای همهٔ فیلدهای این درخواست
             # ➊ بررسی وجود سفارش در انتظار
             order_id = context.user_data.get("pending_order")
             if not order_id:
                 return  # سفارشی در انتظار نیست
 
             # ➋ اعتبارسنجی فرمت TxID
-            if not re.fullmatch(r"[0-9A-Fa-f]{64}", txid):
-                msg = "❌ <b>Invalid TxID format.</b>\nPlease send a valid 64-character hash."
-                
-                translated = await self.translation_manager.translate_for_user(msg, chat_id)
-                return await update.message.reply_text(translated, parse_mode="HTML")
-
-            # ➌ بازیابی سفارش از دیتابیس
-            order = await self.db.collection_orders.find_one({"order_id": order_id})
+            if not _is_hex64(txid):
+                return await update.message.reply_text(
+                    await self._t("trade_invalid_txid", chat_id), parse_mode="HTML"
+                )
+
+            # ➌ قفل اتمیک سفارش (pending_payment → verifying) در یک رفت‌وبرگشت؛
+            #    دو «I Paid» هم‌زمان نمی‌توانند هر دو یک سفارش را بگیرند
+            order = await self.db.collection_orders.find_one_and_update(
+                {"order_id": order_id, "status": "pending_payment"},
+                {"$set": {
+                    "status": "verifying",
+                    "buyer_id": buyer_id,
+                    "txid": txid,
+                    "claimed_at": now,   # برای resume_trades پس از restart
+                    "updated_at": now,
+                }},
+                return_document=ReturnDocument.BEFORE,
+            )
             if not order:
-                msg = "❌ <b>Order not found or expired.</b>\nPlease start a new trade."
-                
-                translated = await self.translation_manager.translate_for_user(msg, chat_id)
-                return await update.message.reply_text(translated, parse_mode="HTML")
+                return await update.message.reply_text(
+                    await self._t("trade_order_missing", chat_id), parse_mode="HTML"
+                )
+
+            # ➍ تأیید تراکنش در بلاک‌چین
+            if await self._verify_trade(order, txid):
+                verified = True
+                # ➎–➑ انتقال توکن، بستن سفارش و اعلان‌ها
+                return await self._complete_trade(update.get_bot(), order, buyer_id, txid, now)
+
+            # هنوز تأیید نشده → به حلقهٔ پایش معاملات سپرده می‌شود و بعداً اطلاع می‌دهیم
+            self._watch_trade(order, txid, buyer_id, update.get_bot(), CONFIRM_TIMEOUT)
+            return await update.message.reply_text(
+                await self._t("trade_not_confirmed", chat_id), parse_mode="HTML"
+            )
+
+        except Exception as e:
+            self.logger.error(f"Error in prompt_trade_txid: {e}", exc_info=True)
+            # سفارش قفل‌شده‌ای که نه پرداختش تأیید شده و نه به حلقهٔ پایش رسیده → آزاد شود
+            if order is not None and not verified and txid not in self._trades:
+                await self._release_order(order["order_id"])
+            await update.message.reply_text(await self._t("trade_error", chat_id), parse_mode="HTML")
 
-            expected_amount = order["amount"] * order["price"]
+        finally:
+            # 🧼 فقط کلید متعلق به این هندلر؛ state و inviter و ... برای بقیهٔ هندلرها می‌مانند
+            context.user_data.pop("pending_order", None)
+    
 
-            # ➍ تأیید تراکنش در بلاک‌چین (Pseudo)    
-            confirmed = await self.blockchain.verify_txid(
+    #-------------------------------------------------------------------------------------   
+    async def _verify_trade(self, order: Dict[str, Any], txid: str) -> bool:
+        async with self._verify_sem:
+            return await self.blockchain.verify_txid(
                 txid=txid,
                 to_address=self.wallet_address,
-                expected_usdt_amount=expected_amount,
+                expected_usdt_amount=order["amount"] * order["price"],
             )
-            
-            if not confirmed:
-                msg = "⏳ <b>Payment not confirmed yet.</b>\nPlease wait a few moments and try again."
-                
-                translated = await self.translation_manager.translate_for_user(msg, chat_id)
-                return await update.message.reply_text(translated, parse_mode="HTML")
 
-            # ➎ انتقال توکن و بستن سفارش
+    #-------------------------------------------------------------------------------------   
+    async def _complete_trade(
+        self, bot, order: Dict[str, Any], buyer_id: int, txid: str,
+        now: Optional[datetime] = None,
+    ) -> None:
+        """
+        مراحل ➎–➑ پس از تأیید پرداخت خریدار:
+        انتقال توکن، بستن سفارش، ویرایش پیام کانال و اعلان به فروشنده و خریدار.
+        now: زمان درخواست فراخواننده (در غیر این صورت همین لحظه) برای همهٔ updated_atها.
+        """
+        order_id = order["order_id"]
+        now = now or datetime.now(timezone.utc)
+
+        # ➎ انتقال توکن و بستن سفارش – گذار شرطی verifying→settling پیش از انتقال تا
+        #    انتقال توکن حتی با resume پس از restart دو بار انجام نشود
+        claimed = await self.db.collection_orders.update_one(
+            {"order_id": order_id, "status": "verifying"},
+            {"$set": {"status": "settling", "updated_at": now}},
+        )
+        if claimed.modified_count != 1:
+            self.logger.info(f"Order {order_id} already settled – skipped")
+            return
+        try:
             await self.db.transfer_tokens(order["seller_id"], buyer_id, order["amount"])
+        except Exception as e:
+            # انتقال انجام نشد → settling→failed با ثبت خطا؛ settling فقط برای crash واقعی
+            # بین انتقال و ثبت completed باقی می‌ماند (resume_trades آن را گزارش می‌کند)
+            self.logger.error(f"Token transfer for order {order_id} failed: {e}", exc_info=True)
             await self.db.collection_orders.update_one(
-                {"order_id": order_id},
+                {"order_id": order_id, "status": "settling"},
                 {"$set": {
-                    "status": "completed",
-                    "buyer_id": buyer_id,
-                    "txid": txid,
-                    "updated_at": datetime.utcnow(),
+                    "status": "failed",
+                    "error": str(e),
+                    "updated_at": now,
                 }}
             )
+            for chat_id in (order["seller_id"], buyer_id):
+                try:
+                    await bot.send_message(
+                        chat_id, await self._t("trade_settle_failed", chat_id), parse_mode="HTML"
+                    )
+                except Exception as notify_err:
+                    self.logger.warning(f"Could not notify {chat_id} about order {order_id}: {notify_err}")
+            return
+        await self.db.collection_orders.update_one(
+            {"order_id": order_id, "status": "settling"},
+            {"$set": {
+                "status": "completed",
+                "updated_at": now,
+            }}
+        )
 
-            # ➏ ویرایش پیام کانال (در صورت امکان)
-            try:
-                await update.get_bot().edit_message_text(
-                    chat_id=TRADE_CHANNEL_ID,
-                    message_id=order["channel_msg_id"],
-                    text=(
-                        f"✅ SOLD\n"
-                        f"Buyer: <a href='tg://user?id={buyer_id}'>link</a>"
-                    ),
-                    parse_mode="HTML",
-                )
-            except Exception as edit_error:
-                self.logger.warning(f"Could not edit channel message for order {order_id}: {edit_error}")
-
-            # ➐ اعلان به فروشنده
-            await update.get_bot().send_message(
-                order["seller_id"],
-                await self.translation_manager.translate_for_user(
-                    "🎉 <b>Your tokens were sold!</b> ✅", order["seller_id"]
+        # ➏ ویرایش پیام کانال (در صورت امکان)
+        try:
+            await bot.edit_message_text(
+                chat_id=TRADE_CHANNEL_ID,
+                message_id=order["channel_msg_id"],
+                text=(
+                    f"✅ SOLD\n"
+                    f"Buyer: <a href='tg://user?id={buyer_id}'>link</a>"
                 ),
-                parse_mode="HTML"
+                parse_mode="HTML",
             )
+        except Exception as edit_error:
+            self.logger.warning(f"Could not edit channel message for order {order_id}: {edit_error}")
 
-            # ➑ اعلان به خریدار
-            msg = "✅ <b>Payment confirmed.</b>\nTokens have been credited to your balance."
-            translated = await self.translation_manager.translate_for_user(msg, chat_id)
-            await update.message.reply_text(translated, parse_mode="HTML")
-
-        except Exception as e:
-            self.logger.error(f"Error in prompt_trade_txid: {e}", exc_info=True)
-            error_text = (
-                "🚫 <b>An error occurred while processing your transaction.</b>\n"
-                "Please try again or contact support."
-            )
-            translated = await self.translation_manager.translate_for_user(error_text, chat_id)
-            await update.message.reply_text(translated, parse_mode="HTML")
+        # ➐ اعلان به فروشنده
+        await bot.send_message(
+            order["seller_id"],
+            await self._t("trade_tokens_sold", order["seller_id"]),
+            parse_mode="HTML"
+        )
 
-        finally:
-            # 🧼 پاک‌سازی state
-            context.user_data.clear()
-    
+        # ➑ اعلان به خریدار
+        await bot.send_message(buyer_id, await self._t("trade_confirmed", buyer_id), parse_mode="HTML")
 
+    #-------------------------------------------------------------------------------------   
+    def _watch_trade(self, order: Dict[str, Any], txid: str, buyer_id: int, bot, timeout: float) -> None:
+        """سپردن سفارش verifying به حلقهٔ پایش معاملات با مهلت timeout ثانیه."""
+        if txid in self._trades:
+            return
+        self._trades[txid] = PendingTrade(
+            order=order, txid=txid, buyer_id=buyer_id, bot=bot,
+            deadline=asyncio.get_running_loop().time() + max(0.0, timeout),
+        )
+        if self._trade_task is None or self._trade_task.done():
+            self._trade_task = self._spawn(self._trade_monitor_loop(), "monitor_trades")
 
+    #-------------------------------------------------------------------------------------   
+    async def resume_trades(self, bot) -> None:
+        """
+        پس از restart: سفارش‌های verifying (قفل‌شده ولی نه تأیید نه آزاد شده) دوباره به حلقهٔ
+        پایش سپرده می‌شوند با باقی‌ماندهٔ مهلت از claimed_at؛ قفل‌های کهنه مهلت صفر می‌گیرند
+        → یک بار دیگر بررسی و سپس تکمیل یا آزاد می‌شوند.
+        سفارش‌های settling (crash حین انتقال توکن) خودکار تکرار نمی‌شوند و فقط گزارش می‌شوند.
+        """
+        now = datetime.now(timezone.utc)
+        resumed = 0
+        try:
+            async for order in self.db.collection_orders.find({"status": {"$in": ["verifying", "settling"]}}):
+                order_id = order.get("order_id")
+                if order["status"] == "settling":
+                    self.logger.error(f"Order {order_id} stuck in 'settling' – needs manual reconciliation")
+                    continue
+                txid, buyer_id = order.get("txid"), order.get("buyer_id")
+                if not txid or not buyer_id:
+                    await self._release_order(order_id)
+                    continue
+                claimed_at = order.get("claimed_at")
+                elapsed = (
+                    (now - claimed_at.replace(tzinfo=timezone.utc)).total_seconds()
+                    if claimed_at else CONFIRM_TIMEOUT
+                )
+                self._watch_trade(order, txid, buyer_id, bot, CONFIRM_TIMEOUT - elapsed)
+                resumed += 1
+        except Exception as e:
+            self.logger.error(f"resume_trades failed: {e}", exc_info=True)
+        if resumed:
+            self.logger.info(f"Resumed {resumed} verifying trade orders")
 
+    #-------------------------------------------------------------------------------------   
+    async def _release_order(self, order_id) -> None:
+        """برگرداندن سفارش verifying به pending_payment (پرداخت تأیید نشد / خطا)."""
+        try:
+            await self.db.collection_orders.update_one(
+                {"order_id": order_id, "status": "verifying"},
+                {"$set": {"status": "pending_payment", "updated_at": datetime.now(timezone.utc)},
+                 "$unset": {"txid": "", "claimed_at": ""}},
+            )
+        except Exception as e:
+            self.logger.error(f"Could not release order {order_id}: {e}", exc_info=True)
 
+    #-------------------------------------------------------------------------------------   
+    async def _trade_monitor_loop(self) -> None:
+        """
+        یک حلقهٔ مشترک برای همهٔ معاملات منتظر تأیید:
+        هر تیک همه با هم (محدود به _verify_sem) بررسی می‌شوند؛ تأییدشده → _complete_trade،
+        پایان مهلت → پیام عدم تأیید. تیک و backoff مستقل از فید عضویت است و خطای یک
+        تیک (DB/شبکه) حلقه را نمی‌کشد؛ فقط تیک بعدی دیرتر اجرا می‌شود.
+        """
+        while self._trades:
+            await asyncio.sleep(self._trade_delay * random.uniform(0.7, 1.3))
+            try:
+                await self._check_trades()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.exception(f"[monitor_trades] tick failed: {e}")
+                self._trade_delay = min(self._trade_delay * 2, MAX_FEED_DELAY)
+
+    async def _check_trades(self) -> None:
+        """یک تیک حلقهٔ معاملات: verify هم‌زمان همه و اقدام بر اساس نتیجه یا مهلت."""
+        trades = list(self._trades.values())
+        results = await asyncio.gather(
+            *(self._verify_trade(t.order, t.txid) for t in trades),
+            return_exceptions=True,
+        )
+        # خطای verify (مثلاً 429 از TronGrid) → تیک بعدی دیرتر؛ تیک سالم → بازگشت به پایه
+        if any(isinstance(ok, Exception) for ok in results):
+            self._trade_delay = min(self._trade_delay * 2, MAX_FEED_DELAY)
+        else:
+            self._trade_delay = MONITOR_TICK
+
+        now = asyncio.get_running_loop().time()
+        for t, ok in zip(trades, results):
+            if ok is True:
+                self._trades.pop(t.txid, None)
+                self._spawn(self._complete_trade(t.bot, t.order, t.buyer_id, t.txid), "complete_trade")
+            elif now >= t.deadline:
+                self._trades.pop(t.txid, None)
+                await self._release_order(t.order["order_id"])
+                self._spawn(
+                    t.bot.send_message(t.buyer_id, await self._t("trade_timeout", t.buyer_id), parse_mode="HTML"),
+                    "trade_timeout",
+                )
@@ -30,7 +30,6 @@ class ConvertTokenHandler:
         
                 # ───➤ ست‌کردن state برای «Convert Token»
         push_state(context, "convert_token")
-        context.user_data['state'] = "convert_token"
         
         chat_id = update.effective_chat.id
         
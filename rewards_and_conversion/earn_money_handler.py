@@ -29,7 +29,6 @@ class EarnMoneyHandler:
     async def coming_soon(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # ───➤ ست‌کردن state برای «Earn Money»
         push_state(context, "earn_money_menu")
-        context.user_data['state'] = "earn_money_menu"
         
         chat_id = update.effective_chat.id
         msg_en = "🚧 This feature is coming soon."
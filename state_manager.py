@@ -1,7 +1,8 @@
 
 
 import logging
-from typing import List, Optional, Callable, Dict
+from enum import Enum
+from typing import List, Optional, Callable, Dict, Union
 from telegram.ext import ContextTypes
 
 # --------------------------------------------------------------------------- #
@@ -25,6 +26,19 @@ STATE_STACK_KEY  = "state_stack"
 CUR_STATE_KEY    = "current_state"
 LEGACY_STATE_KEY = "state"  # for backward-compatibility
 
+# --------------------------------------------------------------------------- #
+#  States                                                                     #
+# --------------------------------------------------------------------------- #
+class PayState(str, Enum):
+    """
+    Join-fee payment flow states.
+    str-valued so they compare/hash equal to the legacy strings already stored
+    in user_data and used as keys in the bot's state router.
+    """
+    PROMPT_TXID   = "prompt_txid"
+    AWAITING_TXID = "awaiting_sub_txid"
+    TXID_RECEIVED = "sub_txid_received"
+
 # --------------------------------------------------------------------------- #
 #  Helper                                                                     #
 # --------------------------------------------------------------------------- #
@@ -40,11 +54,14 @@ def _sync_alias(context: ContextTypes.DEFAULT_TYPE, value: Optional[str]) -> Non
 # --------------------------------------------------------------------------- #
 #  API                                                                        #
 # --------------------------------------------------------------------------- #
-def push_state(context: ContextTypes.DEFAULT_TYPE, state: str) -> None:
+def push_state(context: ContextTypes.DEFAULT_TYPE, state: Union[str, Enum]) -> None:
     """
     Pushes a new state onto the stack (unless identical to current),
     updates current_state and legacy alias.
+    Enum states are stored by value so persisted user_data stays plain strings.
     """
+    if isinstance(state, Enum):
+        state = state.value
     stack: List[str] = context.user_data.setdefault(STATE_STACK_KEY, [])
     top = stack[-1] if stack else None
     if top != state:
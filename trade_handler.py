@@ -34,7 +34,6 @@ class TradeHandler:
         try:
             # ───➤ ست‌کردن state برای نمایش منوی قابلیت‌های آینده
             push_state(context, "trade_menu")
-            context.user_data['state'] = "trade_menu"
 
             chat_id = update.effective_chat.id
             
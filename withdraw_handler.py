@@ -131,7 +131,6 @@ class WithdrawHandler:
 
             # ── ۴) نمایش دکمهٔ تأیید برداشت
             push_state(context, "withdraw_menu")
-            context.user_data["state"] = "withdraw_menu"
 
             msg = (
                 "💸 <b>Withdraw Eligibility Check Passed!</b>\n\n"